@@ -0,0 +1,198 @@
+"""
+Checks that the generator builds the same automata as a reference checkout.
+
+Random grammars, and the bundled examples, are built by this tree and by the
+reference, each in a process of its own. For every grammar the minimized DFA of
+each exclusive state and the reported warnings and errors must be the same.
+DFAs are compared byte by byte from a breadth first numbering of their states,
+so they may differ in state numbering and byte classes, but not in the tokens
+they produce.
+"""
+
+import argparse
+import contextlib
+import hashlib
+import io
+import json
+import os
+import random
+import subprocess
+import sys
+
+
+def rand_re(rnd, depth, frags):
+	kind = rnd.randint(0, 10 if depth > 0 else 3)
+	if kind == 0:
+		return '"' + ''.join(rnd.choice("abc") for i in range(rnd.randint(1, 3))) + '"'
+	if kind == 1:
+		return "[" + ''.join(rnd.sample("abcd", rnd.randint(1, 3))) + "]"
+	if kind == 2:
+		return "[^a" + rnd.choice(["", "b", "\\n"]) + "]"
+	if kind == 3:
+		return "<{frag}>".format(frag=rnd.choice(frags)) if frags else "c"
+	if kind == 4:
+		return "({left} | {right})".format(left=rand_re(rnd, depth - 1, frags), right=rand_re(rnd, depth - 1, frags))
+	if kind == 5:
+		return "({re}){op}".format(re=rand_re(rnd, depth - 1, frags), op=rnd.choice("*+?"))
+	if kind == 6:
+		low = rnd.randint(0, 3)
+		if rnd.random() < 0.7:
+			return "({re}){{{low},{high}}}".format(re=rand_re(rnd, depth - 1, frags), low=low, high=low + rnd.randint(0, 3))
+		return "({re}){{{low}}}".format(re=rand_re(rnd, depth - 1, frags), low=low)
+	if kind == 7:
+		return "~({re})".format(re=rand_re(rnd, depth - 1, frags))
+	return "({left} {right})".format(left=rand_re(rnd, depth - 1, frags), right=rand_re(rnd, depth - 1, frags))
+
+
+def rand_literal(rnd):
+	word = ''.join(rnd.choice("abc+") for i in range(rnd.randint(1, 4)))
+	if rnd.random() < 0.5:
+		return '"' + word + '"'
+	return ' '.join("\\+" if char == "+" else char for char in word)
+
+
+def random_grammar(seed):
+	"""
+	Grammar with fragments, two exclusive states, plain string rules and
+	regexps using every operator.
+	"""
+	rnd = random.Random(seed)
+	lines = ["[general]", "", "state other", "", "[fragments]", ""]
+	frags = []
+	for idx in range(rnd.randint(0, 4)):
+		lines.append("f{idx} {re}".format(idx=idx, re=rand_re(rnd, 3, frags)))
+		frags.append("f{idx}".format(idx=idx))
+	lines += ["", "[grammar]", ""]
+	for idx in range(rnd.randint(1, 8)):
+		states = rnd.choice(["", "", "{other} ", "{-> other} ", "{other} {-> default} "])
+		kind = rnd.random()
+		if kind < 0.3:
+			re = rand_literal(rnd)
+		elif kind < 0.45:
+			re = " | ".join(rand_literal(rnd) for i in range(rnd.randint(2, 4)))
+		else:
+			re = rand_re(rnd, 4, frags)
+		lines.append("t{token} {states}{re}".format(token=rnd.randint(0, 5), states=states, re=re))
+	lines += ["", "[codegen]", "", "source", "\t// equivalence", "", "# end", ""]
+	return "\n".join(lines)
+
+
+def dfa_digest(dfa):
+	# Rows of all 256 bytes in breadth first order from the initial state
+	ids = {0: 0}
+	order = [0]
+	parts = []
+	for state in order:
+		row = []
+		for char in range(256):
+			target = dfa.target(state, char)
+			if target < 0:
+				row.append(-1)
+				continue
+			if target not in ids:
+				ids[target] = len(order)
+				order.append(target)
+			row.append(ids[target])
+		rule = dfa.accept(state)
+		accept = None if rule is None else (rule.token.id, rule.target_state.id)
+		parts.append(repr((accept, row)))
+	return hashlib.md5('\n'.join(parts).encode()).hexdigest()
+
+
+def build_digests(texts, engine):
+	"""
+	Builds every grammar with the jellylexer package on sys.path, returns the
+	digest of each exclusive state and the diagnostics per grammar.
+	"""
+	from jellylib.parsing import SourceFile, SourceOpts
+	from jellylib.error import Error
+	from jellylib.log import set_verbosity
+	from jellylexer.project import parse_project
+	from jellylexer.codegen import Codegen
+
+	set_verbosity(0)
+	results = []
+	for text in texts:
+		digests = dict()
+		diagnostics = io.StringIO()
+		try:
+			with contextlib.redirect_stderr(diagnostics):
+				source = SourceFile("g.jlex", SourceOpts(4))
+				source.feed(text)
+				project = parse_project(source, "g")
+				project.parse()
+				Codegen().parse(project)
+				project.check_used()
+				project.grammar.engine = engine
+				project.build()
+			for xstate in project.grammar.xstates.values():
+				digests[xstate.id] = dfa_digest(xstate.dfa)
+		except Error as e:
+			print("error: {error}".format(error=e), file=diagnostics)
+		results.append({"dfas": digests, "diagnostics": diagnostics.getvalue()})
+	return results
+
+
+def run_worker(root, texts, engine):
+	# Builds in a separate interpreter, so both trees can have a jellylexer package
+	process = subprocess.run(
+		[sys.executable, os.path.realpath(__file__), "--worker", root, "--engine", engine],
+		input=json.dumps(texts), capture_output=True, text=True
+	)
+	if process.returncode != 0:
+		raise RuntimeError("build with {root} failed:\n{err}".format(root=root, err=process.stderr))
+	return json.loads(process.stdout)
+
+
+def main():
+	parser = argparse.ArgumentParser(description="Compare the automata of this tree with a reference checkout")
+	parser.add_argument('--reference', metavar='dir', type=str, help="root of the reference checkout, e.g. made with git worktree add")
+	parser.add_argument('--seeds', metavar='n', type=int, default=200, help="number of random grammars")
+	parser.add_argument('--first-seed', metavar='n', type=int, default=0, help="seed of the first random grammar")
+	parser.add_argument('--example', metavar='name', action='append', help="compare a bundled example grammar as well (repeatable)")
+	parser.add_argument('--engine', metavar='name', type=str, default="thompson", help="automaton construction engine")
+	parser.add_argument('--reference-engine', metavar='name', type=str, help="engine of the reference build (default: --engine)")
+	parser.add_argument('--worker', metavar='dir', type=str, help=argparse.SUPPRESS)
+	args = parser.parse_args()
+
+	if args.worker:
+		sys.path.insert(0, args.worker)
+		json.dump(build_digests(json.load(sys.stdin), args.engine), sys.stdout)
+		return
+
+	if not args.reference:
+		parser.error("--reference is required")
+
+	root = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+	sys.path.insert(0, root)
+	from benchmarks.grammars import example
+
+	names = []
+	texts = []
+	for name in args.example or []:
+		names.append(name)
+		texts.append(example(name))
+	for seed in range(args.first_seed, args.first_seed + args.seeds):
+		names.append("seed {seed}".format(seed=seed))
+		texts.append(random_grammar(seed))
+
+	results = run_worker(root, texts, args.engine)
+	expected = run_worker(os.path.realpath(args.reference), texts, args.reference_engine or args.engine)
+
+	mismatches = 0
+	for name, text, result, reference in zip(names, texts, results, expected):
+		if result == reference:
+			continue
+		mismatches += 1
+		if mismatches == 1:
+			print("{name} differs:\n{text}".format(name=name, text=text))
+			print("this tree: {result}\nreference: {reference}".format(result=result, reference=reference))
+		else:
+			print("{name} differs".format(name=name))
+
+	print("{same} of {num} grammars build the same automata".format(same=len(texts) - mismatches, num=len(texts)))
+	sys.exit(1 if mismatches else 0)
+
+
+if __name__ == "__main__":
+	main()
@@ -0,0 +1,147 @@
+import os
+import random
+
+# Every grammar ends with a comment line, so the parser closes the last value
+Codegen = """
+[codegen]
+
+source
+	// benchmark
+
+# end
+"""
+
+Letters = "abcdefghijklmnopqrstuvwxyz"
+
+
+def make_words(num, seed=1):
+	rnd = random.Random(seed)
+	words = set()
+	while len(words) < num:
+		words.add(''.join(rnd.choice(Letters) for i in range(rnd.randint(2, 12))))
+	return sorted(words)
+
+
+def keywords(num):
+	"""
+	num keyword rules in front of an identifier rule, like a language
+	with a big reserved word list.
+	"""
+	lines = ["[grammar]", ""]
+	for idx, word in enumerate(make_words(num)):
+		lines.append("kw_{idx} \"{word}\"".format(idx=idx, word=word))
+	lines.append("identifier [a-zA-Z_] [a-zA-Z_0-9]*")
+	lines.append("space [ \\t\\r\\n]+")
+	return '\n'.join(lines) + "\n" + Codegen
+
+
+def keyword_list(num):
+	"""
+	num reserved words of one token in a [keywords] section, in front of
+	an identifier rule.
+	"""
+	words = make_words(num)
+	lines = ["[keywords]", "", "reserved"]
+	for idx in range(0, num, 10):
+		lines.append("\t" + " ".join(words[idx:idx + 10]))
+	lines += [
+		"",
+		"[grammar]",
+		"",
+		"identifier [a-zA-Z_] [a-zA-Z_0-9]*",
+		"space [ \\t\\r\\n]+",
+	]
+	return '\n'.join(lines) + "\n" + Codegen
+
+
+def repetition(bound):
+	"""
+	Counted repetitions with growing upper bounds.
+	"""
+	lines = [
+		"[general]",
+		"",
+		"max-repeat {bound}".format(bound=bound),
+		"",
+		"[grammar]",
+		"",
+		"hex 0x [0-9a-fA-F]{{1,{bound}}}".format(bound=bound),
+		"word [a-z]{{2,{bound}}}".format(bound=bound),
+		"digits [0-9]{{{half},{bound}}}".format(half=bound // 2, bound=bound),
+		"space [ \\t\\r\\n]+",
+	]
+	return '\n'.join(lines) + "\n" + Codegen
+
+
+def fragment_depth(depth):
+	"""
+	A chain of fragments where each one refers to the previous one,
+	the last fragment is used by a single rule.
+	"""
+	lines = ["[fragments]", "", "f0 [a-z] [0-9]"]
+	for idx in range(1, depth + 1):
+		ch = Letters[idx % len(Letters)]
+		lines.append("f{idx} (<f{prev}> \"{ch}\") | \"{ch}{ch}\"".format(idx=idx, prev=idx - 1, ch=ch))
+	lines += [
+		"",
+		"[grammar]",
+		"",
+		"deep <f{depth}>".format(depth=depth),
+		"space [ \\t\\r\\n]+",
+	]
+	return '\n'.join(lines) + "\n" + Codegen
+
+
+def xstates(num):
+	"""
+	num exclusive states chained by enter/leave rules, each with rules of its own.
+	"""
+	lines = ["[general]", ""]
+	for idx in range(num):
+		lines.append("state s{idx}".format(idx=idx))
+	lines += ["", "[grammar]", ""]
+	lines.append("enter {-> s0} \"<<\"")
+	for idx in range(num):
+		target = "s{next}".format(next=idx + 1) if idx + 1 < num else "default"
+		lines.append("next_{idx} {{s{idx}}} {{-> {target}}} \">>\"".format(idx=idx, target=target))
+		lines.append("word_{idx} {{s{idx}}} [a-z]+ \"{idx}\"".format(idx=idx))
+		lines.append("num_{idx} {{s{idx}}} [0-9]+ (\".\" [0-9]{{1,{len}}})?".format(idx=idx, len=idx % 8 + 1))
+	states = ''.join("{{s{idx}}}".format(idx=idx) for idx in range(num))
+	lines.append("space {{default}}{states} [ \\t\\r\\n]+".format(states=states))
+	lines.append("identifier [a-zA-Z_] [a-zA-Z_0-9]*")
+	return '\n'.join(lines) + "\n" + Codegen
+
+
+def negated_classes(num):
+	"""
+	num rules over wide negated classes, each excluding a different set of bytes,
+	so the byte equivalence classes get fragmented.
+	"""
+	lines = ["[grammar]", ""]
+	for idx in range(num):
+		excluded = "\\x{code:02x}".format(code=(idx * 7) % 256) + "\\x{code:02x}".format(code=(idx * 13 + 1) % 256)
+		lines.append("neg_{idx} \"q{idx}\" [^{excluded}\\n]* \"q\"".format(idx=idx, excluded=excluded))
+	lines.append("space [ \\t\\r\\n]+")
+	return '\n'.join(lines) + "\n" + Codegen
+
+
+Axes = {
+	"keywords": (keywords, [100, 500, 2000]),
+	"keyword-list": (keyword_list, [1000, 2500, 5000, 10000, 15000]),
+	"repetition": (repetition, [50, 200, 1000]),
+	"fragment-depth": (fragment_depth, [10, 50, 200]),
+	"xstates": (xstates, [8, 32, 128]),
+	"negated-classes": (negated_classes, [16, 64, 192]),
+}
+
+
+def example(name):
+	"""
+	Grammar of a bundled example, examples/name/name.jlex.
+	"""
+	root = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+	with open(os.path.join(root, "examples", name, name + ".jlex"), "r") as f:
+		return f.read()
+
+
+Examples = ["cpp"]
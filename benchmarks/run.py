@@ -0,0 +1,225 @@
+from jellylib.parsing import *
+from jellylib.error import Error
+from jellylib.log import set_verbosity
+from jellylexer.project import parse_project
+from jellylexer.codegen import Codegen
+from jellylexer.dfa_minimize import minimize
+import jellylexer.nfa as nfa
+from benchmarks.grammars import Axes, Examples, example
+from jellylexer.grammar import Engines
+import argparse
+import io
+import json
+import platform
+import sys
+import time
+import tracemalloc
+
+Phases = ("parse", "nfa", "build_from_nfa", "minimize", "build_tables", "write")
+
+
+class PhaseTimer:
+	def __init__(self):
+		self.times = dict()
+		self.phase = None
+		self.begin = None
+
+	def start(self, phase):
+		self.stop()
+		self.phase = phase
+		self.begin = time.perf_counter()
+
+	def stop(self):
+		if self.phase:
+			self.times[self.phase] = self.times.get(self.phase, 0.0) + time.perf_counter() - self.begin
+			self.phase = None
+
+
+def build(name, text, engine):
+	"""
+	Runs the generator on a grammar phase by phase, the way jellylexer.run does
+	with a single job. Returns phase times and automaton sizes.
+	With the followpos engine, the nfa phase builds the positions instead.
+	"""
+	timer = PhaseTimer()
+	stats = dict()
+
+	timer.start("parse")
+	source = SourceFile(name + ".jlex", SourceOpts(4))
+	source.feed(text)
+	project = parse_project(source, name)
+	project.parse()
+	codegen = Codegen()
+	codegen.parse(project)
+	project.check_used()
+
+	grammar = project.grammar
+	grammar.engine = engine
+	xstates = list(grammar.xstates.values())
+
+	timer.start("nfa")
+	grammar.build_fragments()
+	for xstate in xstates:
+		xstate.build_nfa(grammar)
+
+	timer.start("build_from_nfa")
+	full_dfas = [xstate.build_full_dfa() for xstate in xstates]
+
+	timer.start("minimize")
+	for xstate, full_dfa in zip(xstates, full_dfas):
+		xstate.dfa = minimize(full_dfa)
+
+	timer.start("build_tables")
+	codegen.build(project)
+
+	timer.start("write")
+	codegen.write_header(io.StringIO(), name + ".jlex.h")
+	codegen.write_source(io.StringIO(), name + ".jlex.cpp")
+	timer.stop()
+
+	stats["rules"] = sum(len(xstate.rules) for xstate in xstates)
+	stats["xstates"] = len(xstates)
+	if engine == "followpos":
+		stats["nfa_states"] = sum(len(xstate.positions.chars) for xstate in xstates)
+	else:
+		stats["nfa_states"] = sum(len(nfa.number_states(xstate.state_begin)) for xstate in xstates)
+	stats["dfa_states"] = sum(full_dfa.states_num for full_dfa in full_dfas)
+	stats["min_states"] = sum(xstate.dfa.states_num for xstate in xstates)
+	stats["classes"] = max(xstate.dfa.classes_num for xstate in xstates)
+	return timer.times, stats
+
+
+def run_case(axis, size, engine, repeat, memory):
+	if axis == "example":
+		name = size
+		text = example(size)
+	else:
+		make_grammar, _ = Axes[axis]
+		name = "{axis}-{size}".format(axis=axis, size=size).replace("-", "_")
+		text = make_grammar(size)
+
+	# Best of several runs, memory is measured separately since tracing slows everything down
+	best = None
+	for i in range(repeat):
+		times, stats = build(name, text, engine)
+		if best is None:
+			best = times
+		else:
+			best = {phase: min(best[phase], times[phase]) for phase in best}
+
+	result = {
+		"axis": axis,
+		"size": size,
+		"engine": engine,
+		"phases": {phase: best[phase] for phase in Phases},
+		"total": sum(best.values()),
+	}
+	result.update(stats)
+
+	if memory:
+		tracemalloc.start()
+		build(name, text, engine)
+		_, peak = tracemalloc.get_traced_memory()
+		tracemalloc.stop()
+		result["peak_memory"] = peak
+
+	return result
+
+
+def format_result(result):
+	phases = ' '.join("{phase}={time:.3f}".format(phase=phase, time=result["phases"][phase]) for phase in Phases)
+	line = "{axis:>16} {size:>6} {engine:>9} total={total:.3f}s {phases} states={states}".format(
+		axis=result["axis"],
+		size=result["size"],
+		engine=result["engine"],
+		total=result["total"],
+		phases=phases,
+		states=result["min_states"]
+	)
+	if "peak_memory" in result:
+		line += " peak={peak:.1f}MB".format(peak=result["peak_memory"] / (1024 * 1024))
+	return line
+
+
+def compare(results, baseline, threshold):
+	"""
+	Returns descriptions of phases that got slower than threshold times the baseline.
+	"""
+	# Results from before engines could be picked were made with thompson
+	def key(result):
+		return result["axis"], result["size"], result.get("engine", "thompson")
+
+	old_results = {key(result): result for result in baseline["results"]}
+	regressions = []
+	for result in results:
+		old = old_results.get(key(result))
+		if old is None:
+			continue
+		for phase in Phases:
+			old_time = old["phases"].get(phase)
+			new_time = result["phases"][phase]
+			# phases that take less than a millisecond are all noise
+			if not old_time or max(old_time, new_time) < 0.001:
+				continue
+			if new_time > old_time * threshold:
+				regressions.append(
+					"{axis} {size} {engine} {phase}: {old:.3f}s -> {new:.3f}s".format(
+						axis=result["axis"], size=result["size"], engine=result["engine"], phase=phase, old=old_time, new=new_time
+					)
+				)
+	return regressions
+
+
+def main():
+	parser = argparse.ArgumentParser(description="Lexer generator benchmarks")
+	parser.add_argument('--axis', metavar='name', action='append', choices=sorted(Axes), help="benchmark only this axis (repeatable)")
+	parser.add_argument('--size', metavar='n', type=int, action='append', help="grammar size instead of the default sizes (repeatable)")
+	parser.add_argument('--example', metavar='name', action='append', choices=Examples, help="benchmark a bundled example grammar, alone or with the axes given by --axis (repeatable)")
+	parser.add_argument('--engine', metavar='name', action='append', choices=Engines, help="automaton construction engine, each grammar is run with every one given (default: thompson)")
+	parser.add_argument('--repeat', metavar='n', type=int, default=3, help="runs per grammar, the best time is reported")
+	parser.add_argument('--no-memory', action='store_true', help="do not measure peak memory")
+	parser.add_argument('-o', '--output', metavar='file', type=str, help="write results as JSON")
+	parser.add_argument('--compare', metavar='file', type=str, help="JSON results to compare against")
+	parser.add_argument('--threshold', metavar='ratio', type=float, default=1.25, help="slowdown reported as a regression")
+	args = parser.parse_args()
+
+	set_verbosity(0)
+
+	cases = []
+	for axis in args.axis or ([] if args.example else list(Axes)):
+		_, sizes = Axes[axis]
+		cases.extend((axis, size) for size in args.size or sizes)
+	cases.extend(("example", name) for name in args.example or [])
+
+	results = []
+	for axis, size in cases:
+		for engine in args.engine or [Engines[0]]:
+			result = run_case(axis, size, engine, max(1, args.repeat), not args.no_memory)
+			print(format_result(result), flush=True)
+			results.append(result)
+
+	report = {
+		"python": platform.python_version(),
+		"platform": platform.platform(),
+		"results": results,
+	}
+
+	if args.output:
+		with open(args.output, "w") as f:
+			json.dump(report, f, indent=1)
+
+	if args.compare:
+		with open(args.compare, "r") as f:
+			regressions = compare(results, json.load(f), args.threshold)
+		for regression in regressions:
+			print("slower: " + regression)
+		if regressions:
+			sys.exit(1)
+
+
+if __name__ == "__main__":
+	try:
+		main()
+	except Error as e:
+		print(e, file=sys.stderr)
+		sys.exit(1)
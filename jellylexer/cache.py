@@ -0,0 +1,103 @@
+import hashlib
+import os
+import pickle
+import jellylib.log as log
+
+# Bump when the layout of cache entries changes
+CacheFormat = 5
+
+GeneratorFiles = (".py", ".h", ".cpp")
+
+
+def generator_version():
+	"""
+	Digest of the generator sources and templates.
+	Any change to the generator invalidates all cached builds.
+	"""
+	digest = hashlib.sha256()
+	digest.update(str(CacheFormat).encode())
+	root = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+	for package in ("jellylexer", "jellylib"):
+		package_dir = os.path.join(root, package)
+		for name in sorted(os.listdir(package_dir)):
+			if not name.endswith(GeneratorFiles):
+				continue
+			digest.update(package.encode())
+			digest.update(name.encode())
+			with open(os.path.join(package_dir, name), "rb") as f:
+				digest.update(f.read())
+	return digest.hexdigest()
+
+
+def normalize_grammar(text):
+	# Line endings and trailing whitespace never reach the parsed grammar
+	return "\n".join(line.rstrip() for line in text.splitlines())
+
+
+class BuildCache:
+	"""
+	Content addressed store of build results.
+
+	A build entry holds the codegen substitutions and the lexer tables, which is
+	everything write_header, write_source and write_tables need, and the warnings
+	of the build, which are printed again when the entry is used. Separate entries
+	hold the build results of each exclusive state (see XState.result), keyed by
+	XState.fingerprint, so a changed grammar only rebuilds the states it affects.
+	"""
+
+	def __init__(self, directory):
+		self.directory = directory
+		self.version = generator_version()
+
+	def key(self, input_file, text, engine, external_tables=False, table_width=None, token_width=None, parallel=False):
+		# Generated code depends on where the tables go, on their layout and on the extra functions,
+		# the engine is part of the key so a build with another engine really runs it
+		digest = hashlib.sha256()
+		for part in (self.version, input_file, engine, str(external_tables), str(table_width), str(token_width), str(parallel), normalize_grammar(text)):
+			digest.update(part.encode())
+			digest.update(b"\0")
+		return digest.hexdigest()
+
+	def xstate_key(self, fingerprint):
+		digest = hashlib.sha256()
+		for part in (self.version, "xstate", fingerprint):
+			digest.update(part.encode())
+			digest.update(b"\0")
+		return digest.hexdigest()
+
+	def load_xstate(self, fingerprint):
+		return self.load(self.xstate_key(fingerprint))
+
+	def store_xstate(self, fingerprint, result):
+		self.store(self.xstate_key(fingerprint), result)
+
+	def path(self, key):
+		return os.path.join(self.directory, key + ".pickle")
+
+	def load(self, key):
+		path = self.path(key)
+		if not os.path.exists(path):
+			log.log(2, "Build cache miss {key}", key=key)
+			return None
+		try:
+			with open(path, "rb") as f:
+				entry = pickle.load(f)
+		except (OSError, EOFError, pickle.UnpicklingError) as e:
+			log.log(1, "Ignoring broken build cache entry {path}: {error}", path=repr(path), error=e)
+			return None
+		log.log(2, "Build cache hit {key}", key=key)
+		return entry
+
+	def store(self, key, entry):
+		os.makedirs(self.directory, exist_ok=True)
+		path = self.path(key)
+		tmp_path = "{path}.{pid}.tmp".format(path=path, pid=os.getpid())
+		with open(tmp_path, "wb") as f:
+			pickle.dump(entry, f, protocol=pickle.HIGHEST_PROTOCOL)
+		os.replace(tmp_path, path)
+		log.log(2, "Stored build cache entry {path}", path=repr(path))
+
+
+def make_entry(codegen, grammar):
+	warnings = [line for xstate in grammar.xstates.values() for line in xstate.warning_lines()]
+	return {"substs": codegen.substs, "tables": codegen.tables, "table_width": codegen.table_width, "warnings": warnings}
@@ -4,21 +4,102 @@ from jellylib.parsing import Whitespaces, Parser, Newlines, EOF, Spaces
 from jellylib.error import Error
 import string
 import json
+import itertools
+import operator
 import jellylib.log as log
+from jellylexer.tables import make_tables, AcceptFlag, TokenShift, StateMask, MaxStates, MaxNarrowStates
+from jellylexer.tables_file import TablesVersion
 
 
 SubstRegexp = re.compile("\$\(([a-zA-Z0-9_\-]+)\)")
 
+ExternalTablesDeclarations = """/**
+* Lexer tables loaded from a table file
+*/
+struct Tables{{
+	const uint32_t* eq_class;
+	const uint32_t* transitions;
+	const uint32_t* eof_transitions;
+	// TokenID of each token in the table file
+	TokenID* token_ids;
+	// initial state of each exclusive state, in the order of State
+	uint32_t states[{states_num}];
+	// memory mapping of the table file, if any
+	void* mapping;
+	size_t mapping_size;
+}};
+
+/// Loads tables from a table file, the file is memory mapped and shared between processes
+/// Returns false if the file cannot be read, or its tokens and states do not match the lexer
+bool load_tables              ( Tables* tables, const char* path );
+/// Loads tables from memory, which must stay valid until unload_tables
+bool load_tables_from_memory  ( Tables* tables, const void* data, size_t size );
+/// Releases tables, lexers must not use them afterwards
+void unload_tables            ( Tables* tables );
+/// Makes the lexer use the tables and puts it into the initial state of the default exclusive state
+/// Call it after init, before run; later calls are allowed between tokens (e.g. after finalize)
+/// A token read partially by run is dropped, tokens already in the buffers are kept
+void set_tables               ( Lexer* jlex_lexer, const Tables* tables );"""
+
+ParallelDeclarations = """
+/// Runs the lexer like run, splitting the input between up to 'threads' threads (0 - one per core)
+/// Results are the same as those of run, buffers must be as large as for run
+/// Inputs smaller than 64 KB per thread use fewer threads
+void run_parallel         ( Lexer* jlex_lexer, unsigned threads );"""
+
+
+# Output is passed to the stream in pieces of about this many characters
+WriterBufferSize = 1 << 16
+
 
 class FormattedWriter:
+	"""
+	Buffered output of a generated file, counts lines for #line directives.
+	line_num is the number of the line being written. Nothing reaches the stream
+	past the last full buffer until flush is called.
+	"""
+
 	def __init__(self, stream):
 		self.stream = stream
+		self.chunks = []
+		self.size = 0
+		self.line_num = 1
 
-	def __del__(self):
-		self.flush()
+	def write(self, text):
+		self.chunks.append(text)
+		self.size += len(text)
+		self.line_num += text.count("\n")
+		if self.size >= WriterBufferSize:
+			self.flush()
 
 	def flush(self):
-		pass
+		if self.chunks:
+			self.stream.write(''.join(self.chunks))
+			self.chunks = []
+			self.size = 0
+
+
+class Template:
+	"""
+	Template file split into lines. Each line is its indent and a list of parts,
+	text at even positions and substitution ids at odd ones.
+	"""
+
+	def __init__(self, text):
+		self.lines = []
+		for line in text.splitlines(keepends=True):
+			self.lines.append((find_indent(line), SubstRegexp.split(line)))
+
+
+# Templates are read once per process
+Templates = dict()
+
+
+def load_template(templatename):
+	if templatename not in Templates:
+		with open(os.path.join(os.path.dirname(os.path.realpath(__file__)), templatename), 'r') as file:
+			Templates[templatename] = Template(file.read())
+	return Templates[templatename]
 
 
 class SubstValue:
@@ -33,12 +114,50 @@ class SubstValue:
 			self.lines[-1] += sep
 		self.lines.append(line)
 
+	def iter_lines(self):
+		return iter(self.lines)
+
+	def write(self, out, indent):
+		# Lines after the first one are followed by the indent of the template line
+		lines = self.iter_lines()
+		for line in lines:
+			out.write(line)
+			break
+		for line in lines:
+			out.write("\n" + line + indent)
+
 	def __str__(self):
 		if len(self.lines) > 1:
 			raise RuntimeError("value is not inline")
 		return ''.join(self.lines)
 
 
+class TableValue(SubstValue):
+	"""
+	Substitution for a large table, lines are formatted while they are written.
+
+	Each line is a row of row_size values, written as strings[value] followed by
+	suffixes[column] if given, and separated by sep. Lines end with "," except the last one.
+	"""
+
+	def __init__(self, values, row_size, strings, suffixes = None, sep = ", "):
+		super().__init__()
+		self.values = values
+		self.row_size = row_size
+		self.strings = strings
+		self.suffixes = suffixes
+		self.sep = sep
+
+	def iter_lines(self):
+		last = len(self.values) - self.row_size
+		for begin in range(0, len(self.values), self.row_size):
+			items = map(self.strings.__getitem__, self.values[begin:begin + self.row_size])
+			if self.suffixes is not None:
+				items = map(operator.add, items, self.suffixes)
+			line = self.sep.join(items)
+			yield line + "," if begin < last else line
+
+
 class SubstCodeParser(Parser):
 	def __init__(self):
 		super().__init__()
@@ -130,23 +249,45 @@ def capitalize(id):
 	return string.capwords(id, sep="_").replace("_", "")
 
 
+def find_indent(s):
+	indent = []
+	for ch in s:
+		if ch in Whitespaces:
+			indent.append(ch)
+		else:
+			break
+	return ''.join(indent)
+
+
+def format_distinct(values, format):
+	# Tables have few distinct values, each one is formatted once
+	return {value: format(value) for value in set(values)}
+
+
+def format_tokens(tables, format, no_token):
+	# Strings indexed by the values of tables.accept_tokens: format(index, name)
+	# for each token, NoToken picks the last item
+	return [format(idx, token) for idx, token in enumerate(tables.token_names)] + [no_token]
+
+
 def chunks(l, n):
 	for i in range(0, len(l), n):
 		yield l[i:i + n]
 
 
-class CodegenState:
-	def __init__(self, dfa_state, index):
-		self.dfa_state = dfa_state
-		self.index = index
-		self.offset = 4 * index
-		self.reset_state = None
-
-
 class Codegen:
 	def __init__(self):
 		self.writer = None
 		self.substs = dict()
+		self.tables = None
+		# tables are loaded at runtime from a table file instead of compiled in
+		self.external_tables = False
+		# width of transition table entries: 16, 32 or None to pick the narrowest one
+		self.table_width = None
+		# width of token ids written by run, or None to write actions and convert them later
+		self.token_width = None
+		# generate run_parallel
+		self.parallel = False
 
 	def parse(self, project):
 		for section in project.get_sections("codegen"):
@@ -179,171 +320,232 @@ class Codegen:
 	def build(self, project):
 		grammar = project.grammar
 
-		self.build_tables(grammar)
+		# Limits of the tables are reported at the first section with rules
+		loc = next((section.loc for section in project.sections if section.name in ("keywords", "grammar")), None)
+		self.build_tables(grammar, loc)
 
 		self.substs["lexer_trap"] = SubstValue()
 
-	def build_tables(self, grammar):
-		classes = [set(range(256))]
-
-		unique_refines = set()
-
-		def refine(partition):
-			if partition in unique_refines:
-				return
-			unique_refines.add(partition)
-			n = len(classes)
-			for idx in range(n):
-				clss = classes[idx]
-				inter = clss.intersection(partition)
-				if len(inter) == len(clss):
-					continue
-				if len(inter) == 0:
-					continue
-				clss.difference_update(inter)
-				classes.append(inter)
-
-		for xstate in grammar.xstates.values():
-			def state_visitor(state):
-				state_classes = dict()
-				for idx, target_state in enumerate(state.trans):
-					if target_state not in state_classes:
-						state_classes[target_state] = set()
-					state_classes[target_state].add(idx)
-				for target_state, chars in state_classes.items():
-					refine(tuple(chars))
-
-			xstate.dfa_state.visit(state_visitor)
-
-		eq_classes = [None] * 256
-		for idx, chars in enumerate(classes):
-			for ch in chars:
-				eq_classes[ch] = idx
-
-		states = dict()
-		states_list = []
+		if self.parallel:
+			for line in ParallelDeclarations.split("\n"):
+				self.substs["extra_declarations"].add_line(line)
+
+	def build_tables(self, grammar, loc=None):
+		tables = make_tables(grammar)
+		self.tables = tables
+		states_num = tables.states_num
+
+		if states_num > MaxStates:
+			raise Error(loc, "too many dfa states ({num}), at most {max} are supported".format(num=states_num, max=MaxStates))
+		if self.token_width == 8 and len(tables.token_names) > 256:
+			raise Error(loc, "too many tokens ({num}) for 8-bit token ids".format(num=len(tables.token_names)))
+
+		if self.external_tables:
+			# table files have the wide layout
+			self.table_width = 32
+		elif self.table_width is None:
+			self.table_width = 16 if states_num <= MaxNarrowStates else 32
+		elif self.table_width == 16 and states_num > MaxNarrowStates:
+			raise Error(loc, "too many dfa states ({num}) for 16-bit tables, at most {max} are supported".format(num=states_num, max=MaxNarrowStates))
+		entry_size = self.table_width // 8
 
 		enum_states = SubstValue()
 		set_state_switch = SubstValue()
 
-		tokens = dict()
-		tokens_list = []
-
-		for xstate in grammar.xstates.values():
-			def state_visitor(state):
-				codegen_state = CodegenState(state, len(states))
-				states_list.append(codegen_state)
-				states[state] = codegen_state
-				if state.accepts:
-					codegen_state.reset_state = state.accepts.target_state.dfa_state
-					token = state.accepts.token
-					if token not in tokens:
-						tokens[token] = len(tokens)
-						tokens_list.append(token)
-				else:
-					codegen_state.reset_state = xstate.dfa_state
-
-			xstate.dfa_state.visit(state_visitor)
-
+		for idx, xstate in enumerate(grammar.xstates.values()):
 			state_name = capitalize(xstate.id)
 			enum_states.add_line(state_name, ",")
+			if self.external_tables:
+				state_id = "jlex_lexer->tables->states[{idx}]".format(idx=idx)
+			else:
+				state_id = tables.xstate_bases[xstate.id]
 			set_state_switch.add_line(
 				"case State::{state}: jlex_lexer->state = {state_id}; break;".format(
 					prefix=self.substs["prefix"],
 					state=state_name,
-					state_id=states[xstate.dfa_state].offset
+					state_id=state_id
 				)
 			)
 
 		self.substs["enum_states"] = enum_states
 		self.substs["set_state_switch"] = set_state_switch
 
-		states_num = len(states)
+		tokens_value = SubstValue()
+		enum_tokens_val = SubstValue()
 
-		transitions = dict()
-		eof_transitions = dict()
+		for token_name in tables.token_names:
+			tokens_value.add_line(json.dumps(token_name), ",")
+			enum_tokens_val.add_line(capitalize(token_name), ",")
 
-		for state in states_list:
-			dfa_state = state.dfa_state
+		self.substs["token_names"] = tokens_value
+		self.substs["enum_tokens"] = enum_tokens_val
+		self.build_stats_tables(tables)
+
+		log.log(2, "Equivalence classes: {num}", num=tables.classes_num)
+		log.log(2, "Transition table size: {num} KB", num= (states_num * tables.classes_num * entry_size) / 1024)
+
+		if self.external_tables:
+			self.build_external_tables(grammar, tables)
+		elif self.table_width == 16:
+			self.build_narrow_tables(tables)
+		else:
+			self.build_static_tables(tables)
+		self.build_token_output()
+
+	def build_stats_tables(self, tables):
+		# Tables of lexer-stats.cpp
+		self.substs["states_num"] = SubstValue(str(tables.states_num))
+		self.substs["classes_num"] = SubstValue(str(tables.classes_num))
+
+		token_indices = format_tokens(tables, lambda idx, token: str(idx), "0xffff")
+		self.substs["stats_state_tokens"] = TableValue(tables.accept_tokens, 16, token_indices)
+
+		byte_classes = SubstValue()
+		for chunk in chunks(tables.eq_classes, 16):
+			byte_classes.add_line(', '.join(map(str, chunk)), ",")
+		self.substs["stats_byte_classes"] = byte_classes
+
+	def table_bytes(self):
+		# Size of the tables in the generated source or the table file
+		tables = self.tables
+		entry_size = self.table_width // 8
+		size = 4 * len(tables.eq_classes) + (tables.classes_num + 1) * tables.states_num * entry_size
+		if self.table_width == 16 and not self.external_tables:
+			size += tables.states_num * (self.token_width or 16) // 8
+		return size
+
+	def build_token_output(self):
+		if self.token_width is None:
+			self.substs["token_type"] = SubstValue("uint16_t")
+			self.substs["token_buffer_type"] = SubstValue("uint32_t")
+			self.substs["token_offset"] = SubstValue("jlex_token_idx")
+
+			convert = SubstValue()
+			convert.add_line("\tTokenID* output = (TokenID*)jlex_lexer->tokens;")
+			convert.add_line("\tuint32_t* input = jlex_lexer->tokens;")
+			convert.add_line("")
+			convert.add_line("\t// Reads from, and writes to the same buffer.")
+			convert.add_line("\t// Converts dfa actions into token ids")
+			convert.add_line("\tfor ( size_t i = 0; i < jlex_lexer->index; i++ ){")
+			convert.add_line("\t\tuint32_t token = input[i];")
+			convert.add_line("\t\toutput[i] = {token_id};".format(token_id=self.substs["token_id"]))
+			convert.add_line("\t}")
+			convert.add_line("")
+			self.substs["convert_tokens"] = convert
+			return
+
+		# run writes token ids, jlex_token_idx still counts bytes of the offsets buffer
+		token_type = "uint{width}_t".format(width=self.token_width)
+		self.substs["token_type"] = SubstValue(token_type)
+		self.substs["token_buffer_type"] = SubstValue(token_type)
+		self.substs["token_offset"] = SubstValue("(jlex_token_idx >> {shift}u)".format(shift=2 if self.token_width == 8 else 1))
+		self.substs["convert_tokens"] = SubstValue("\t// Token ids are written by run")
+
+		if self.external_tables:
+			self.substs["run_tables"].add_line("\tconst TokenID* jlex_token_ids = jlex_lexer->tables->token_ids;")
+			self.substs["finalize_tables"].add_line("\tconst TokenID* jlex_token_ids = jlex_lexer->tables->token_ids;")
+			self.substs["action_token"] = SubstValue("jlex_token_ids[(jlex_state_next >> {shift}) & 0xfffu]".format(shift=TokenShift))
+		elif self.table_width == 32:
+			self.substs["action_token"] = SubstValue("(TokenID) ((jlex_state_next >> {shift}) & 0xfffu)".format(shift=TokenShift))
+
+	def build_static_tables(self, tables):
+		states_num = tables.states_num
+
+		hex_values = format_distinct(itertools.chain(tables.transitions, tables.eof_transitions), hex)
+		# token field of the actions of each state
+		token_fields = format_tokens(tables, lambda idx, token: "|((TOKEN({token}))<<{shift})".format(token=token, shift=TokenShift), "")
+		state_fields = list(map(token_fields.__getitem__, tables.accept_tokens))
 
-			if dfa_state.accepts:
-				# accept...
-				accept_value = 0x80000000
-				accept_name = dfa_state.accepts.token.id
-			else:
-				# does not accept
-				accept_value = 0
-				accept_name = None
-
-			reset_dfa_state = state.reset_state
-			reset_state = states[reset_dfa_state]
-
-			for clss, chars in enumerate(classes):
-				ch = list(chars)[0]
-				target_state = dfa_state.trans[ch]
-				if target_state is None:
-					# current state does not accept the following character
-					reset_target_state = reset_dfa_state.trans[ch]
-					if reset_target_state is None:
-						# next state cannot parse character, trap
-						target_value = 0
-					else:
-						target_value = accept_value | states[reset_target_state].offset
-				else:
-					target_value = states[target_state].offset
 
-				if accept_name:
-					target_value = f"{hex(target_value)}|((TOKEN({accept_name}))<<16)"
-				else:
-					target_value = hex(target_value)
+		eq_classes_val = SubstValue()
+		for chunk in chunks(tables.eq_classes, 16):
+			line = ', '.join(map(lambda n: str(n * states_num), chunk))
+			eq_classes_val.add_line(line, ",")
+
+		self.substs["eof_transitions"] = TableValue(tables.eof_transitions, states_num, hex_values, state_fields, ",")
+		self.substs["transitions"] = TableValue(tables.transitions, states_num, hex_values, state_fields)
+		self.substs["eq_classes"] = eq_classes_val
 
-				transitions[clss * states_num + state.index] = target_value
+		self.substs["run_tables"] = SubstValue()
+		self.substs["finalize_tables"] = SubstValue()
+		self.substs["token_id"] = SubstValue("(TokenID) ((token >> {shift}) & 0xfffu)".format(shift=TokenShift))
+		self.substs["extra_declarations"] = SubstValue()
+		self.set_wide_actions()
 
-			if accept_name:
-				accept_value = f"{hex(accept_value)}|((TOKEN({accept_name}))<<16)"
-			else:
-				accept_value = hex(accept_value)
+	def build_narrow_tables(self, tables):
+		# Code for lexer-tables-narrow.cpp, the token is looked up by state only on ACCEPT
+		states_num = tables.states_num
 
-			eof_transitions[state.index] = accept_value
+		def format_action(value):
+			narrow = value & ~AcceptFlag
+			if value & AcceptFlag:
+				narrow |= 0x8000
+			return hex(narrow)
 
 		eq_classes_val = SubstValue()
-		for chunk in chunks(eq_classes, 16):
-			line = ', '.join(map(lambda n: str(n * states_num * 4), chunk))
+		for chunk in chunks(tables.eq_classes, 16):
+			line = ', '.join(map(lambda n: str(n * states_num), chunk))
 			eq_classes_val.add_line(line, ",")
 
-		eof_transitions_val = SubstValue()
-		out = []
-		for state in states_list:
-			out.append(eof_transitions[state.index])
-		self.substs["eof_transitions"] = SubstValue(",".join(out))
-
-		transitions_val = SubstValue()
-		for clss, _ in enumerate(classes):
-			items = []
-			for state in states_list:
-				#if clss == 0:
-					# trap on zero byte
-				#	items.append(0)
-				#else:
-				items.append(transitions[clss * states_num + state.index])
-			line = ', '.join(items)
-			transitions_val.add_line(line, ",")
+		narrow_values = format_distinct(itertools.chain(tables.transitions, tables.eof_transitions), format_action)
+		self.substs["eof_transitions"] = TableValue(tables.eof_transitions, states_num, narrow_values, sep=",")
 
-		tokens_value = SubstValue()
-		enum_tokens_val = SubstValue()
+		token_values = format_tokens(tables, lambda idx, token: "TOKEN({token})".format(token=token), "0")
 
-		for token in tokens_list:
-			tokens_value.add_line(json.dumps(token.id), ",")
-			enum_tokens_val.add_line(capitalize(token.id), ",")
+		self.substs["transitions"] = TableValue(tables.transitions, states_num, narrow_values)
+		self.substs["eq_classes"] = eq_classes_val
+		self.substs["state_tokens"] = TableValue(tables.accept_tokens, 8, token_values)
+
+		self.substs["run_tables"] = SubstValue()
+		self.substs["finalize_tables"] = SubstValue()
+		self.substs["token_id"] = SubstValue("(TokenID) token")
+		self.substs["extra_declarations"] = SubstValue()
+
+		# Token of the current state is written on every byte, it is kept only on ACCEPT
+		self.substs["action_type"] = SubstValue("uint16_t")
+		self.substs["action_token"] = SubstValue("jlex_state_tokens[jlex_state]")
+		self.substs["state_mask"] = SubstValue("0x7fff")
+		self.substs["accept_step"] = SubstValue("((jlex_state_next >> 15u) << 2u)")
+
+	def set_wide_actions(self):
+		# The whole action is written, it is converted to a token id later
+		self.substs["action_type"] = SubstValue("uint32_t")
+		self.substs["action_token"] = SubstValue("jlex_state_next")
+		self.substs["state_mask"] = SubstValue(hex(StateMask))
+		self.substs["accept_step"] = SubstValue("((jlex_state_next >> 31u) << 2u)")
+
+	def build_external_tables(self, grammar, tables):
+		# Code for lexer-tables-file.cpp, the tables themselves are written by tables_file
+		self.substs["tables_version"] = SubstValue(str(TablesVersion))
+
+		token_values = SubstValue()
+		for token_name in tables.token_names:
+			token_values.add_line("TOKEN({token})".format(token=token_name), ",")
+		self.substs["token_values"] = token_values
+
+		state_names = SubstValue()
+		for xstate in grammar.xstates.values():
+			state_names.add_line(json.dumps(xstate.id), ",")
+		self.substs["state_names"] = state_names
 
-		log.log(2, "Equivalence classes: {num}", num=len(classes))
-		log.log(2, "Transition table size: {num} KB", num= (states_num * len(classes) * 4) / 1024)
+		# A lexer reads tables through its pointer, locals keep them out of the loop
+		run_tables = SubstValue()
+		run_tables.add_line("\tconst uint32_t* jlex_eq_class = jlex_lexer->tables->eq_class;")
+		run_tables.add_line("\tconst uint32_t* jlex_transitions = jlex_lexer->tables->transitions;")
+		self.substs["run_tables"] = run_tables
+		self.substs["finalize_tables"] = SubstValue("\tconst uint32_t* jlex_eof_transitions = jlex_lexer->tables->eof_transitions;")
+		self.substs["token_id"] = SubstValue("jlex_lexer->tables->token_ids[(token >> {shift}) & 0xfffu]".format(shift=TokenShift))
 
-		self.substs["token_names"] = tokens_value
-		self.substs["enum_tokens"] = enum_tokens_val
+		extra_fields = SubstValue()
+		extra_fields.add_line("\t// tables in use, see set_tables")
+		extra_fields.add_line("\tconst struct Tables* tables;")
+		self.substs["extra_fields"] = extra_fields
 
-		self.substs["transitions"] = transitions_val
-		self.substs["eq_classes"] = eq_classes_val
+		declarations = SubstValue()
+		for line in ExternalTablesDeclarations.format(states_num=len(grammar.xstates)).split("\n"):
+			declarations.add_line(line)
+		self.substs["extra_declarations"] = declarations
+		self.set_wide_actions()
 
 
 	def parse_subst_code(self, span):
@@ -356,54 +558,46 @@ class Codegen:
 		parser.set_source(span)
 		return parser.parse_inline()
 
-	def write_header(self, out, filename):
-		self.line_num = 1
+	def write_header(self, stream, filename):
+		out = FormattedWriter(stream)
 		self.process_template("lexer-header-prefix.h", out, filename)
 		self.process_template("lexer-header.h", out, filename)
+		out.flush()
 
-	def write_source(self, out, filename):
-		self.line_num = 1
+	def write_source(self, stream, filename):
+		out = FormattedWriter(stream)
 		self.process_template("lexer-source-prefix.cpp", out, filename)
 		self.process_template("lexer-header.h", out, filename)
 		self.process_template("lexer-source.cpp", out, filename)
+		if self.external_tables:
+			self.process_template("lexer-tables-file.cpp", out, filename)
+		elif self.table_width == 16:
+			self.process_template("lexer-tables-narrow.cpp", out, filename)
+		else:
+			self.process_template("lexer-tables.cpp", out, filename)
+		self.process_template("lexer-run.cpp", out, filename)
+		if not self.external_tables:
+			self.process_template("lexer-stats.cpp", out, filename)
+		if self.parallel:
+			self.process_template("lexer-parallel.cpp", out, filename)
+		out.flush()
 
 	def process_template(self, templatename, out, filename):
-		with open(os.path.join(os.path.dirname(os.path.realpath(__file__)), templatename), 'r') as file:
-			for line in file:
-				indent = self.find_indent(line)
-				should_reset_line = False
-
-				def subst(match):
-					nonlocal should_reset_line
-					id = match.group(1)
-					if id not in self.substs:
-						raise RuntimeError("substitution for {id} not found".format(id=id))
-					val = self.substs[id]
-
-					if val.changes_line_info:
-						should_reset_line = True
-					self.line_num += max(0, len(val.lines) - 1)
-
-					if len(val.lines) == 0:
-						return ""
-					elif len(val.lines) == 1:
-						return val.lines[0]
-					else:
-						return val.lines[0] + ''.join(map(lambda s: "\n" + s + indent, val.lines[1:]))
-
-				line = SubstRegexp.sub(subst, line)
-				out.write(line)
-				if line.endswith("\n") or line.endswith("\r"):
-					self.line_num += 1
-				if should_reset_line:
-					self.line_num += 1
-					out.write("#line {line} {file}\n".format(line=self.line_num, file=json.dumps(filename)))
-
-	def find_indent(self, s):
-		indent = []
-		for ch in s:
-			if ch in Whitespaces:
-				indent.append(ch)
-			else:
-				break
-		return ''.join(indent)
\ No newline at end of file
+		for indent, parts in load_template(templatename).lines:
+			should_reset_line = False
+
+			for idx, part in enumerate(parts):
+				if idx % 2 == 0:
+					if part:
+						out.write(part)
+					continue
+				if part not in self.substs:
+					raise RuntimeError("substitution for {id} not found".format(id=part))
+				val = self.substs[part]
+				if val.changes_line_info:
+					should_reset_line = True
+				val.write(out, indent)
+
+			if should_reset_line:
+				# the directive sets the number of the line after it
+				out.write("#line {line} {file}\n".format(line=out.line_num + 1, file=json.dumps(filename)))
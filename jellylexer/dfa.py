@@ -1,76 +1,204 @@
-from jellylexer.dfa_vis import visualize
+from array import array
+import jellylexer.nfa as nfa
 
+NoState = -1
+NoRule = -1
+
+from jellylexer.dfa_vis import visualize
 
-class State:
-	def __init__(self):
-		self.trans = [None] * 256
-		self.accepts = None
 
-	def visit(self, visitor):
-		visited = set()
+class DFA:
+	"""
+	Deterministic automaton with dense integer state ids.
+
+	Input bytes are mapped to classes with class_map. Transitions are kept in one
+	flat array, row by row: trans[state * classes_num + clss] is the target state,
+	or NoState. accepts[state] is an index into rules, or NoRule.
+	State 0 is the initial state.
+	"""
+
+	def __init__(self, class_map, classes_num, rules=None):
+		self.class_map = bytes(class_map)
+		self.classes_num = classes_num
+		self.trans = array('i')
+		self.accepts = array('i')
+		self.rules = rules if rules is not None else []
+		self.rule_index = {rule: idx for idx, rule in enumerate(self.rules)}
+
+	@property
+	def states_num(self):
+		return len(self.accepts)
+
+	def add_state(self):
+		self.trans.extend(self.empty_row())
+		self.accepts.append(NoRule)
+		return len(self.accepts) - 1
+
+	def empty_row(self):
+		return array('i', [NoState]) * self.classes_num
+
+	def row(self, state):
+		begin = state * self.classes_num
+		return self.trans[begin:begin + self.classes_num]
+
+	def target(self, state, char):
+		return self.trans[state * self.classes_num + self.class_map[char]]
+
+	def set_target(self, state, clss, target_state):
+		self.trans[state * self.classes_num + clss] = target_state
+
+	def accept(self, state):
+		idx = self.accepts[state]
+		if idx == NoRule:
+			return None
+		return self.rules[idx]
+
+	def set_accept(self, state, rule):
+		if rule is None:
+			self.accepts[state] = NoRule
+			return
+		if rule not in self.rule_index:
+			self.rule_index[rule] = len(self.rules)
+			self.rules.append(rule)
+		self.accepts[state] = self.rule_index[rule]
+
+	def pack(self):
+		"""
+		Returns a picklable form of the automaton that refers to rules by their order
+		in the exclusive state instead of by object.
+		"""
+		return self.class_map, self.classes_num, self.trans, self.accepts, [rule.order for rule in self.rules]
+
+	def class_chars(self):
+		chars = [[] for i in range(self.classes_num)]
+		for char, clss in enumerate(self.class_map):
+			chars[clss].append(char)
+		return chars
+
+	def class_order(self):
+		# classes in the order of their first byte
+		order = []
+		seen = set()
+		for clss in self.class_map:
+			if clss not in seen:
+				seen.add(clss)
+				order.append(clss)
+		return order
+
+	def preorder(self):
+		"""
+		Returns state ids in depth first order from the initial state,
+		following transitions in byte order.
+		"""
+		k = self.classes_num
+		order = [0]
+		seen = bytearray(self.states_num)
+		seen[0] = 1
+		class_order = self.class_order()
+		stack = [(0, 0)]
+		while stack:
+			state, pos = stack[-1]
+			if pos == len(class_order):
+				stack.pop()
+				continue
+			stack[-1] = (state, pos + 1)
+			target_state = self.trans[state * k + class_order[pos]]
+			if target_state != NoState and not seen[target_state]:
+				seen[target_state] = 1
+				order.append(target_state)
+				stack.append((target_state, 0))
+		return order
+
+	def renumber(self, order):
+		"""
+		Returns a copy of the automaton where state order[i] becomes state i.
+		"""
+		k = self.classes_num
+		new_id = array('i', [NoState]) * self.states_num
+		for idx, state in enumerate(order):
+			new_id[state] = idx
+		out = DFA(self.class_map, k, self.rules)
+		out.trans = array('i', [NoState]) * (len(order) * k)
+		out.accepts = array('i', [NoRule]) * len(order)
+		for idx, state in enumerate(order):
+			begin = state * k
+			out_begin = idx * k
+			for clss in range(k):
+				target_state = self.trans[begin + clss]
+				if target_state != NoState:
+					out.trans[out_begin + clss] = new_id[target_state]
+			out.accepts[idx] = self.accepts[state]
+		return out
 
-		def _visit(state):
-			if state is None:
-				return
-			if state in visited:
-				return
-			visited.add(state)
-			visitor(state)
-			for target_state in state.trans:
-				_visit(target_state)
 
-		_visit(self)
+class Builder:
+	"""
+	Subset construction over the strongly connected components of the epsilon
+	transitions of the NFA.
 
+	Components are numbered densely in the order Tarjan's algorithm completes them,
+	so every component reachable from another one has a smaller number. The epsilon
+	closure of a component and every DFA subset are sorted tuples of these numbers.
+	Int bitsets would make unions cheaper, but a bitset takes as many bits as its
+	highest component number however few it holds, and most closures are small.
+	"""
 
-class SCC:
 	def __init__(self):
 		self.states = []
-		self.closure = None
-
-	def add(self, state):
-		self.states.append(state)
-
-	def build_closure(self):
-		self.closure = set()
-		self.closure.add(self)
+		# component of each NFA state, by state id
+		self.scc_of = None
+		self.closures = []
+		# (classes, closure of the target) pairs and the accepted rule of each component
+		self.moves = []
+		self.accepts = []
+		self.members = None
+		self.powerset = dict()
+		self.worklist = []
+		self.classes = None
+		self.char_classes = None
+		self.dfa = None
 
-		other_closures = set()
+	def build(self, state):
+		self.states = nfa.number_states(state)
 
-		for state in self.states:
-			for target_state in state.etrans:
-				if target_state.scc == self:
-					continue
-				other_closures.add(target_state.scc.closure)
+		self.build_classes()
+		self.find_scc()
 
-		for closure in other_closures:
-			self.closure.update(closure)
+		self.get_dfa_for_subset(self.closures[self.scc_of[state.id]])
+		self.process()
 
-		self.closure = frozenset(self.closure)
+		return self.dfa
 
+	def build_classes(self):
+		# Bytes that belong to the same NFA char sets are never distinguished,
+		# so subset construction runs over these classes instead of all 256 bytes
+		charsets = dict()
+		for state in self.states:
+			for chars, _ in state.trans:
+				if chars not in charsets:
+					charsets[chars] = len(charsets)
 
-class Builder:
-	def __init__(self):
-		self.states = set()
-		self.powerset = dict()
-		self.worklist = []
+		signatures = [[] for i in range(256)]
+		for chars, idx in charsets.items():
+			for char in chars:
+				signatures[char].append(idx)
 
-	def build(self, state):
-		def pre_visit(state):
-			state.closure = None
-			state.scc_index = None
-			state.scc_lowlink = None
-			state.scc_onstack = False
-			state.scc = None
-			self.states.add(state)
+		classes = dict()
+		for char, signature in enumerate(signatures):
+			classes.setdefault(tuple(signature), []).append(char)
 
-		state.visit(pre_visit)
+		self.classes = list(classes.values())
+		self.char_classes = dict()
 
-		self.find_scc()
+		class_of = [None] * 256
+		for clss, chars in enumerate(self.classes):
+			for char in chars:
+				class_of[char] = clss
 
-		dfa_state = self.get_dfa_for_subset(state.scc.closure)
-		self.process()
+		for chars in charsets:
+			self.char_classes[chars] = tuple(sorted(set(class_of[char] for char in chars)))
 
-		return dfa_state
+		self.dfa = DFA(class_of, len(self.classes))
 
 	def process(self):
 		i = 0
@@ -80,79 +208,157 @@ class Builder:
 			i += 1
 
 	def process_dfa_state(self, subset, dfa_state):
-		transitions = [set() for i in range(256)]
-		accepts = set()
+		# Closures reached on each class
+		transitions = [None] * len(self.classes)
+		accept = None
 
 		for scc in subset:
-			for nfa_state in scc.states:
-				if nfa_state.rule:
-					accepts.add(nfa_state.rule)
-				for chars, target_state in nfa_state.trans:
-					for char in chars:
-						transitions[char].update(target_state.scc.closure)
-
-		transitions = map(frozenset, transitions)
-		for idx, subset in enumerate(transitions):
-			if len(subset) == 0:
-				dfa_state.trans[idx] = None
+			rule = self.accepts[scc]
+			if rule is not None and (accept is None or rule.order < accept.order):
+				accept = rule
+			for classes, closure in self.moves[scc]:
+				for clss in classes:
+					closures = transitions[clss]
+					if closures is None:
+						transitions[clss] = [closure]
+					else:
+						closures.append(closure)
+
+		# A single closure already is a subset, and classes that reach the same
+		# closures share one union
+		unions = dict()
+		for clss, closures in enumerate(transitions):
+			if closures is None:
+				continue
+			if len(closures) == 1:
+				target = closures[0]
 			else:
-				dfa_state.trans[idx] = self.get_dfa_for_subset(subset)
-
-		if len(accepts) > 0:
-			accept = min(accepts, key=lambda rule:rule.order)
-			dfa_state.accepts = accept
+				key = tuple(map(id, closures))
+				target = unions.get(key)
+				if target is None:
+					target = unions[key] = tuple(sorted(set().union(*closures)))
+			self.dfa.set_target(dfa_state, clss, self.get_dfa_for_subset(target))
 
+		if accept is not None:
+			self.dfa.set_accept(dfa_state, accept)
 
 	def get_dfa_for_subset(self, subset):
 		if subset not in self.powerset:
-			dfa_state = State()
+			dfa_state = self.dfa.add_state()
 			self.worklist.append((subset, dfa_state))
 			self.powerset[subset] = dfa_state
 		return self.powerset[subset]
 
 	def find_scc(self):
-		index = 0
+		# Tarjan's algorithm with an explicit stack, indexed by the dense state ids
+		states = self.states
+		states_num = len(states)
+		index = [None] * states_num
+		lowlink = [0] * states_num
+		onstack = bytearray(states_num)
 		stack = []
+		counter = 0
+		self.scc_of = [None] * states_num
+		self.members = []
+
+		for root in range(states_num):
+			if index[root] is not None:
+				continue
+
+			index[root] = lowlink[root] = counter
+			counter += 1
+			stack.append(root)
+			onstack[root] = 1
+			work = [(root, 0)]
+
+			while work:
+				v, pos = work[-1]
+				etrans = states[v].etrans
+				if pos < len(etrans):
+					work[-1] = (v, pos + 1)
+					w = etrans[pos].id
+					if index[w] is None:
+						index[w] = lowlink[w] = counter
+						counter += 1
+						stack.append(w)
+						onstack[w] = 1
+						work.append((w, 0))
+					elif onstack[w]:
+						lowlink[v] = min(lowlink[v], index[w])
+					continue
 
-		def strongconnect(v):
-			nonlocal index
-			v.scc_index = index
-			v.scc_lowlink = index
-			index += 1
-			stack.append(v)
-			v.scc_onstack = True
-
-			for w in v.etrans:
-				if w.scc_index is None:
-					strongconnect(w)
-					v.scc_lowlink = min(v.scc_lowlink, w.scc_lowlink)
-				elif w.scc_onstack:
-					v.scc_lowlink = min(v.scc_lowlink, w.scc_index)
-
-			if v.scc_lowlink == v.scc_index:
-				scc = SCC()
-
-				while True:
-					w = stack.pop()
-					w.scc_onstack = False
-					scc.add(w)
-					w.scc = scc
-					if w == v:
-						break
-
-				scc.build_closure()
-
-		for state in self.states:
-			if state.scc_index is None:
-				strongconnect(state)
-
-
-	def get_transitive_closure(self, state):
-		return state.scc.closure
-
+				work.pop()
+				if work:
+					u = work[-1][0]
+					lowlink[u] = min(lowlink[u], lowlink[v])
+
+				if lowlink[v] == index[v]:
+					members = []
+					while True:
+						w = stack.pop()
+						onstack[w] = 0
+						members.append(w)
+						if w == v:
+							break
+					self.add_scc(members)
+
+		# Char transitions may lead to components completed later, so moves come last
+		self.moves = [self.build_moves(members) for members in self.members]
+		self.members = None
+
+	def add_scc(self, members):
+		scc = len(self.closures)
+		scc_of = self.scc_of
+		for w in members:
+			scc_of[w] = scc
+
+		# Epsilon targets outside the component were completed before it
+		others = set()
+		for w in members:
+			for target_state in self.states[w].etrans:
+				other = scc_of[target_state.id]
+				if other != scc:
+					others.add(other)
+
+		if not others:
+			closure = (scc,)
+		elif len(others) == 1:
+			closure = self.closures[others.pop()] + (scc,)
+		else:
+			closure = {scc}
+			for other in others:
+				closure.update(self.closures[other])
+			closure = tuple(sorted(closure))
+		self.closures.append(closure)
+
+		accept = None
+		for w in members:
+			rule = self.states[w].rule
+			if rule is not None and (accept is None or rule.order < accept.order):
+				accept = rule
+		self.accepts.append(accept)
+		self.members.append(members)
+
+	def build_moves(self, members):
+		# Char transitions of a component as (classes, closure of the target) pairs
+		moves = []
+		for w in members:
+			for chars, target_state in self.states[w].trans:
+				moves.append((self.char_classes[chars], self.closures[self.scc_of[target_state.id]]))
+		return moves
 
 
 def build_from_nfa(state):
 	builder = Builder()
 	return builder.build(state)
 
+
+def unpack_dfa(packed, rules):
+	"""
+	Restores an automaton saved with DFA.pack, rules are the rules of its exclusive state.
+	"""
+	class_map, classes_num, trans, accepts, orders = packed
+	dfa = DFA(class_map, classes_num, [rules[order - 1] for order in orders])
+	dfa.trans = trans
+	dfa.accepts = accepts
+	return dfa
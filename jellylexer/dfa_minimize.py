@@ -1,130 +1,136 @@
 from jellylexer.dfa import *
 import jellylib.log as log
+import gc
 
 
 class MinimizeDFA:
-	def __init__(self):
-		self.states = []
-		self.disjoint = set()
+	"""
+	Hopcroft's partition refinement.
 
-	def run(self, state):
-		log.log(1, "Running DFA minimization")
-
-		def pre_visit(state):
-			self.states.append(state)
-			state.repr = None
-
-		state.visit(pre_visit)
-
-		equivalences = [self.states]
-		states_num = len(self.states)
-		states_processed = 0
-
-		def assign_repr():
-			for sublist in equivalences:
-				for state in sublist:
-					state.repr = sublist[0]
-
-		def refine_list(states, refiner):
-			nonlocal states_processed
-			out = []
-
-			for state in states:
-				for out_list in out:
-					if refiner(out_list[0], state):
-						out_list.append(state)
-						break
-				else:
-					out.append([state])
-				states_processed += 1
-
-				if log.Verbosity >= 1:
-					log.print_progress(states_processed, states_num)
-
-			return out, len(out) > 1
-
-		def refine_all(refiner):
-			nonlocal equivalences, states_processed
-			states_processed = 0
-			new_equivalences = []
-			any_progress = False
-			for sublist in equivalences:
-				if len(sublist) > 1:
-					out, progress = refine_list(sublist, refiner)
-					new_equivalences.extend(out)
-					if progress:
-						any_progress = True
-				else:
-					states_processed += 1
-					new_equivalences.append(sublist)
-
-			if log.Verbosity >= 1:
-				log.print_progress(states_processed, states_num)
-
-			equivalences = new_equivalences
-			assign_repr()
-			return any_progress
-
-		def compare_accepts(accept1, accept2):
-			if accept1 == accept2:
-				return True
-			if (accept1 is None) != (accept2 is None):
-				return False
-			return accept1.token == accept2.token and accept1.target_state == accept2.target_state
-
-		def refiner_accept(state1, state2):
-			return compare_accepts(state1.accepts, state2.accepts)
-
-		def is_same_class(state1, state2):
-			if state1 == state2:
-				return True
-			if (state1 is None) != (state2 is None):
-				return False
-			if state1.repr is state2.repr:
-				return True
-			return False
-
-		def refiner_trans(state1, state2):
-			for i in range(256):
-				if not is_same_class(state1.trans[i], state2.trans[i]):
-					return False
-			return True
+	Works on the input equivalence classes of the DFA instead of the raw bytes,
+	and splits blocks with inverse transitions taken from a queue of splitters,
+	which gives O(n * k * log n) for n states and k classes.
+	"""
 
+	def run(self, dfa):
+		log.log(1, "Running DFA minimization")
 
+		states_num = dfa.states_num
+		classes_num = dfa.classes_num
 		log.log(2, "Total states: {states}", states=states_num)
 
-		assign_repr()
-		refine_all(refiner_accept)
-		while refine_all(refiner_trans):
-			pass
-
-
-		new_states = dict()
-		new_states_num = 0
-
-		def remap_state(state):
-			nonlocal new_states_num
-			if state is None:
+		# Missing transitions go to an explicit trap state, so the automaton is complete.
+		# The trap is never merged with a real state.
+		trap = states_num
+
+		# inverse[clss][target] lists all states going to target on clss,
+		# pred_classes[target] the classes it has any such states on
+		inverse = []
+		pred_classes = [[] for i in range(states_num + 1)]
+		for clss in range(classes_num):
+			preds = [[] for i in range(states_num + 1)]
+			for s, target in enumerate(dfa.trans[clss::classes_num]):
+				preds[target if target != NoState else trap].append(s)
+			preds[trap].append(trap)
+			inverse.append(preds)
+			for target, states in enumerate(preds):
+				if states:
+					pred_classes[target].append(clss)
+
+		# Initial partition: by accepted token and target state, trap on its own
+		def accept_key(rule):
+			if rule is None:
 				return None
-			state = state.repr
-			if state in new_states:
-				return new_states[state]
-			new_state = State()
-			new_states_num += 1
-			new_state.accepts = state.accepts
-			new_states[state] = new_state
-			for i in range(256):
-				new_state.trans[i] = remap_state(state.trans[i])
-			return new_state
-
-		out_state = remap_state(state)
-		log.log(2, "Total states after minimization: {states}", states=new_states_num)
-
-		return out_state
-
-
-
-
-def minimize(state):
+			return rule.token, rule.target_state
+
+		initial = dict()
+		for s in range(states_num):
+			initial.setdefault(accept_key(dfa.accept(s)), []).append(s)
+
+		blocks = [set(members) for members in initial.values()]
+		blocks.append({trap})
+		block_of = [0] * (states_num + 1)
+		for idx, block in enumerate(blocks):
+			for s in block:
+				block_of[s] = idx
+
+		worklist = list(range(len(blocks)))
+		in_worklist = [True] * len(blocks)
+
+		while worklist:
+			splitter = worklist.pop()
+			in_worklist[splitter] = False
+			splitter_states = list(blocks[splitter])
+
+			# Classes no state of the splitter is reached on split nothing
+			classes = set()
+			for target in splitter_states:
+				classes.update(pred_classes[target])
+
+			for clss in classes:
+				preds = inverse[clss]
+				touched = dict()
+				for target in splitter_states:
+					for s in preds[target]:
+						touched.setdefault(block_of[s], []).append(s)
+
+				for idx, members in touched.items():
+					block = blocks[idx]
+					if len(members) == len(block):
+						continue
+
+					new_idx = len(blocks)
+					new_block = set(members)
+					block.difference_update(new_block)
+					blocks.append(new_block)
+					for s in new_block:
+						block_of[s] = new_idx
+
+					if in_worklist[idx]:
+						worklist.append(new_idx)
+						in_worklist.append(True)
+					elif len(new_block) <= len(block):
+						worklist.append(new_idx)
+						in_worklist.append(True)
+					else:
+						worklist.append(idx)
+						in_worklist[idx] = True
+						in_worklist.append(False)
+
+		# Build the quotient automaton, one state per block
+		block_state = dict()
+		representatives = []
+		for s in range(states_num):
+			idx = block_of[s]
+			if idx not in block_state:
+				block_state[idx] = len(representatives)
+				representatives.append(s)
+
+		out = DFA(dfa.class_map, classes_num, dfa.rules)
+		out.trans = array('i', [NoState]) * (len(representatives) * classes_num)
+		out.accepts = array('i', [NoRule]) * len(representatives)
+		for new_s, s in enumerate(representatives):
+			out.accepts[new_s] = dfa.accepts[s]
+			begin = new_s * classes_num
+			for clss, target in enumerate(dfa.row(s)):
+				if target != NoState:
+					out.trans[begin + clss] = block_state[block_of[target]]
+
+		# State ids follow the depth first order, so they do not depend on block numbering
+		out = out.renumber(out.preorder())
+		log.log(2, "Total states after minimization: {states}", states=out.states_num)
+
+		return out
+
+
+def minimize(dfa):
 	m = MinimizeDFA()
-	return m.run(state)
\ No newline at end of file
+	enabled = gc.isenabled()
+	# The partition allocates millions of small lists without cycles, and the cyclic
+	# garbage collector would walk all of them over and over
+	gc.disable()
+	try:
+		return m.run(dfa)
+	finally:
+		if enabled:
+			gc.enable()
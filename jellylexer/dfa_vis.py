@@ -2,11 +2,9 @@ from jellylexer.dfa import *
 from graphviz import Digraph
 
 
-def visualize(state):
+def visualize(dfa):
 	G = Digraph()
 
-	states = set()
-
 	def compress(s):
 		ranges = []
 		range = None
@@ -27,33 +25,27 @@ def visualize(state):
 				out.append(chr(end))
 		return ''.join(out)
 
-	def process_state(state):
-		if state in states:
-			return
-		states.add(state)
-		state.id = str(len(states))
-
-		if state.accepts:
-			state.name = state.accepts.token.id
+	for state in range(dfa.states_num):
+		rule = dfa.accept(state)
+		if rule:
+			name = rule.token.id
 		else:
-			state.name = state.id
-
-		G.node(state.id, state.name)
+			name = str(state)
+		G.node(str(state), name)
 
+	for state in range(dfa.states_num):
 		target_states = dict()
 
-		for ch, target_state in enumerate(state.trans):
-			if target_state is None:
+		for ch in range(256):
+			target_state = dfa.target(state, ch)
+			if target_state == NoState:
 				continue
 			if target_state not in target_states:
 				target_states[target_state] = []
 			target_states[target_state].append(ch)
 
 		for target_state, chars in target_states.items():
-			process_state(target_state)
 			label = repr(compress(''.join(map(chr, chars))))
-			G.edge(state.id, target_state.id, label)
-
-	process_state(state)
+			G.edge(str(state), str(target_state), label)
 
-	G.render(directory="vis/", view=True, cleanup=True)
\ No newline at end of file
+	G.render(directory="vis/", view=True, cleanup=True)
@@ -0,0 +1,246 @@
+from jellylexer.regexp import *
+from jellylexer.dfa import DFA
+import jellylib.log as log
+
+
+def bit_positions(bits):
+	# Indices of the set bits, lowest first
+	while bits:
+		low = bits & -bits
+		yield low.bit_length() - 1
+		bits ^= low
+
+
+class Positions:
+	"""
+	Glushkov automaton of the rules of an exclusive state, built straight from
+	the regexp trees instead of going through a Thompson NFA.
+
+	Every character set in the expanded rules (fragments are expanded at each use,
+	repetitions once per copy) is a position. Sets of positions are Python ints
+	used as bitsets: follow[pos] are the positions that may come right after pos.
+	A DFA state is the set of positions the input may have just matched, kept as
+	a sorted tuple, which hashes faster than the bitset of a large grammar.
+	Position 0 stands for the start, it follows nothing and nothing follows it
+	but the first positions of the rules. rules[pos] is the rule that accepts
+	after pos, if pos may end a match.
+	"""
+
+	def __init__(self, ctx):
+		self.ctx = ctx
+		self.chars = [frozenset()]
+		self.follow = [0]
+		self.rules = [None]
+
+	def instantiate(self, template):
+		# Copies the positions of a template after the existing ones
+		base = len(self.chars)
+		self.chars.extend(template.chars)
+		self.follow.extend([bits << base for bits in template.follow])
+		self.rules.extend([None] * len(template.chars))
+		return template.nullable, template.first << base, template.last << base
+
+	def add_rule(self, rule):
+		nullable, first, last = self.visit(rule.re)
+		self.follow[0] |= first
+		if nullable:
+			last |= 1
+		for pos in bit_positions(last):
+			if self.rules[pos] is None or rule.order < self.rules[pos].order:
+				self.rules[pos] = rule
+
+	def first_chars(self):
+		# Characters a match of any rule can start with
+		chars = set()
+		for pos in bit_positions(self.follow[0]):
+			chars.update(self.chars[pos])
+		return chars
+
+	def add_position(self, chars):
+		self.chars.append(chars)
+		self.follow.append(0)
+		self.rules.append(None)
+		return 1 << (len(self.chars) - 1)
+
+	def add_follow(self, last, first):
+		if first:
+			for pos in bit_positions(last):
+				self.follow[pos] |= first
+
+	def visit(self, re):
+		"""
+		Adds the positions of re and the follow sets inside it.
+		Returns whether re matches the empty string, its first and its last positions.
+		"""
+		if isinstance(re, ReChar):
+			pos = self.add_position(re.chars)
+			return False, pos, pos
+		elif isinstance(re, ReEmpty):
+			return True, 0, 0
+		elif isinstance(re, ReRef):
+			fragment = self.ctx.get_fragment(re.loc, re.id)
+			chars = fragment.get_chars(self.ctx)
+			if chars is not None:
+				pos = self.add_position(chars)
+				return False, pos, pos
+			return self.instantiate(fragment_template(self.ctx, fragment))
+		elif isinstance(re, ReConcat):
+			return self.visit_concat((self.visit(part) for part in flatten(re, ReConcat)))
+		elif isinstance(re, ReChoice):
+			nullable, first, last = False, 0, 0
+			for part in flatten(re, ReChoice):
+				part_nullable, part_first, part_last = self.visit(part)
+				nullable = nullable or part_nullable
+				first |= part_first
+				last |= part_last
+			return nullable, first, last
+		elif isinstance(re, ReStar):
+			_, first, last = self.visit(re.re)
+			self.add_follow(last, first)
+			return True, first, last
+		elif isinstance(re, ReRepeat):
+			if re.max == 0:
+				return True, 0, 0
+			template = Template(self.ctx, re.re)
+			copies = [self.instantiate(template) for i in range(re.max)]
+			# Copies after the first min ones are optional, each one together with
+			# the rest, like the Thompson chain: a{1,3} is a (a a?)?
+			# This way a copy is only followed by the next one.
+			nullable, first, last = True, 0, 0
+			for i in reversed(range(re.max)):
+				copy_nullable, copy_first, copy_last = copies[i]
+				self.add_follow(copy_last, first)
+				if copy_nullable:
+					first |= copy_first
+				else:
+					first = copy_first
+				if nullable:
+					last |= copy_last
+				nullable = (nullable and copy_nullable) or i >= re.min
+			return nullable, first, last
+		elif isinstance(re, RePrefix):
+			# Any prefix matches, so every position inside may end the match
+			begin = len(self.chars)
+			_, first, _ = self.visit(re.re)
+			inside = ((1 << len(self.chars)) - 1) ^ ((1 << begin) - 1)
+			return True, first, inside
+		raise RuntimeError("unknown regexp node {node}".format(node=type(re).__name__))
+
+	def visit_concat(self, parts):
+		nullable, first, last = True, 0, 0
+		for part_nullable, part_first, part_last in parts:
+			self.add_follow(last, part_first)
+			if nullable:
+				first |= part_first
+			if part_nullable:
+				last |= part_last
+			else:
+				last = part_last
+			nullable = nullable and part_nullable
+		return nullable, first, last
+
+	def build_classes(self):
+		# Same classes as dfa.Builder.build_classes makes from the NFA char sets
+		charsets = dict()
+		for pos, chars in enumerate(self.chars):
+			if chars:
+				charsets.setdefault(chars, []).append(pos)
+
+		signatures = [[] for i in range(256)]
+		for idx, chars in enumerate(charsets):
+			for char in chars:
+				signatures[char].append(idx)
+
+		classes = dict()
+		class_of = [0] * 256
+		for char, signature in enumerate(signatures):
+			class_of[char] = classes.setdefault(tuple(signature), len(classes))
+
+		# Classes matched by each position
+		pos_classes = [()] * len(self.chars)
+		for chars, positions in charsets.items():
+			chars_classes = tuple(sorted(set(class_of[char] for char in chars)))
+			for pos in positions:
+				pos_classes[pos] = chars_classes
+		return class_of, len(classes), pos_classes
+
+	def build_dfa(self):
+		"""
+		Subset construction over sets of positions. The target of a state on a class
+		is the union of the follow sets of its positions, limited to the positions
+		that match the class.
+		"""
+		class_of, classes_num, pos_classes = self.build_classes()
+		log.log(2, "Positions: {num}, classes: {classes}", num=len(self.chars), classes=classes_num)
+
+		dfa = DFA(class_of, classes_num)
+		follow = self.follow
+		rules = self.rules
+
+		powerset = {(0,): dfa.add_state()}
+		worklist = [(0,)]
+		i = 0
+		while i < len(worklist):
+			subset = worklist[i]
+			dfa_state = powerset[subset]
+			i += 1
+
+			targets = 0
+			accept = None
+			for pos in subset:
+				targets |= follow[pos]
+				rule = rules[pos]
+				if rule is not None and (accept is None or rule.order < accept.order):
+					accept = rule
+
+			# Target positions in order, grouped by class
+			class_targets = dict()
+			for pos in bit_positions(targets):
+				for clss in pos_classes[pos]:
+					if clss in class_targets:
+						class_targets[clss].append(pos)
+					else:
+						class_targets[clss] = [pos]
+
+			for clss, target in sorted(class_targets.items()):
+				target = tuple(target)
+				if target not in powerset:
+					powerset[target] = dfa.add_state()
+					worklist.append(target)
+				dfa.set_target(dfa_state, clss, powerset[target])
+
+			if accept is not None:
+				dfa.set_accept(dfa_state, accept)
+
+		return dfa
+
+
+class Template:
+	"""
+	Positions of a regexp, built once and copied for each use like nfa.Template.
+	Positions are numbered from 0, follow sets only refer to the template itself.
+	"""
+
+	def __init__(self, ctx, re):
+		positions = Positions(ctx)
+		self.nullable, first, last = positions.visit(re)
+		# without the start position
+		self.first = first >> 1
+		self.last = last >> 1
+		self.chars = positions.chars[1:]
+		self.follow = [bits >> 1 for bits in positions.follow[1:]]
+
+
+def fragment_template(ctx, fragment):
+	if fragment.positions is None:
+		fragment.enter(ctx)
+		fragment.positions = Template(ctx, fragment.re)
+		fragment.leave(ctx)
+	return fragment.positions
+
+
+def build_fragments(ctx):
+	# Templates of all fragments, in order, so nested fragments are not built recursively
+	for fragment in ctx.fragments.values():
+		if fragment.get_chars(ctx) is None:
+			fragment_template(ctx, fragment)
@@ -1,37 +1,87 @@
 from jellylexer.regexp import *
 from jellylib.error import Error
-from jellylexer.regexp_parser import RegexpParser
+from jellylexer.regexp_parser import RegexpParser, DefaultMaxRepeat
 from jellylib.parsing import EOF
 import jellylexer.nfa as nfa
 import jellylexer.dfa as dfa
+import jellylexer.followpos as followpos
+import jellylexer.literals as literals
 from jellylexer.dfa_minimize import minimize
 import sys
+import hashlib
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
 import jellylib.log as log
+import jellylib.profile as profile
 
 class Fragment:
 	def __init__(self, id, loc, re):
 		self.id = id
 		self.re = re
 		self.loc = loc
-		self.nfa = None
+		self.template = None
+		self.chars = None
+		self.chars_resolved = False
+		self.busy = False
+		# followpos.Template, built instead of template by the followpos engine
+		self.positions = None
+
+	def enter(self, ctx):
+		if self.busy:
+			cycle = ctx.entered_fragments[ctx.entered_fragments.index(self):] + [self]
+			raise Error(self.loc, "fragment '{fragment}' refers to itself: {cycle}".format(
+				fragment=self.id,
+				cycle=" -> ".join(fragment.id for fragment in cycle)
+			))
+		self.busy = True
+		ctx.entered_fragments.append(self)
+
+	def leave(self, ctx):
+		self.busy = False
+		ctx.entered_fragments.pop()
+
+	def get_chars(self, ctx):
+		# Fragments that match a single character from a set are folded into that set
+		if not self.chars_resolved:
+			self.enter(ctx)
+			self.chars = char_class(self.re, ctx)
+			self.leave(ctx)
+			self.chars_resolved = True
+		return self.chars
 
 	def build(self, ctx):
-		if not self.nfa:
-			self.nfa = (nfa.State(), nfa.State())
-			self.re.build_nfa(ctx, *self.nfa)
+		if self.get_chars(ctx) is not None:
+			return
+		if not self.template:
+			self.enter(ctx)
+			begin, end = nfa.State(), nfa.State()
+			self.re.build_nfa(ctx, begin, end)
+			self.template = nfa.Template(begin, end)
+			self.leave(ctx)
 
 	def build_nfa(self, ctx, begin, end):
 		self.build(ctx)
-		frag_begin, frag_end = nfa.clone(*self.nfa)
-		begin.add_etrans(frag_begin)
-		frag_end.add_etrans(end)
+		if self.chars is not None:
+			begin.add_trans(self.chars, end)
+		else:
+			# instantiated by nfa.expand_calls once the whole automaton is built
+			nfa.add_call(begin, end, self.template)
+
+
+# Ways to build the automata: Thompson NFA and subset construction,
+# or the Glushkov automaton made straight from the regexps (see followpos)
+Engines = ("thompson", "followpos")
 
 
 class GrammarContext:
 	def __init__(self):
 		self.fragments = dict()
+		self.charsets = dict()
 		self.tokens = dict()
 		self.xstates = dict()
+		self.engine = "thompson"
+		# fragments being built, innermost last, see Fragment.enter
+		self.entered_fragments = []
 		self.add_xstate(XState("default"))
 
 	def add_xstate(self, xstate):
@@ -70,12 +120,97 @@ class GrammarContext:
 			raise Error(loc, "no such fragment '{fragment}'".format(fragment=id))
 		return self.fragments[id]
 
-	def build(self):
-		for fragment in self.fragments.values():
-			fragment.build(self)
+	def fragment_closure(self, rules):
+		# Fragments the rules refer to, directly or through other fragments
+		found = dict()
+		stack = [ref for rule in rules for ref in references(rule.re)]
+		while stack:
+			ref = stack.pop()
+			if ref.id in found:
+				continue
+			fragment = self.get_fragment(ref.loc, ref.id)
+			found[ref.id] = fragment
+			stack.extend(references(fragment.re))
+		return found
+
+	def intern_chars(self, chars):
+		# Equal char sets share one object
+		chars = frozenset(chars)
+		return self.charsets.setdefault(chars, chars)
+
+	def build_fragments(self):
+		if self.engine == "followpos":
+			followpos.build_fragments(self)
+		else:
+			for fragment in self.fragments.values():
+				fragment.build(self)
+
+	def build(self, jobs=1, cache=None):
+		"""
+		Builds the automata of all exclusive states.
+		With a cache (see cache.BuildCache), states whose rules and fragments did not
+		change since they were stored are restored instead of being built.
+		"""
+		with profile.phase("phases", "fragments"):
+			self.build_fragments()
+
+		xstates = []
+		fingerprints = dict()
+		for xstate in self.xstates.values():
+			if cache:
+				fingerprints[xstate.id] = xstate.fingerprint(self)
+				result = cache.load_xstate(fingerprints[xstate.id])
+				if result is not None:
+					log.log(2, "Reusing state {state}", state=xstate.id)
+					xstate.restore(self, result)
+					profile.record("xstates", xstate.id, cached=True)
+					continue
+			xstates.append(xstate)
+
+		if jobs > 1 and len(xstates) > 1 and "fork" in multiprocessing.get_all_start_methods():
+			self.build_parallel(xstates, jobs)
+		else:
+			for xstate in xstates:
+				xstate.build(self)
+
+		if cache:
+			for xstate in xstates:
+				cache.store_xstate(fingerprints[xstate.id], xstate.result())
 
 		for xstate in self.xstates.values():
-			xstate.build(self)
+			profile.record("xstates", xstate.id, min_states=xstate.dfa.states_num, classes=xstate.dfa.classes_num)
+			xstate.report_warnings()
+
+	def build_parallel(self, xstates, jobs):
+		# Workers are forked after the fragments are built, so they share them
+		# and the rest of the grammar with this process. Each worker sends back
+		# the start characters of the error rule and the packed minimized DFA,
+		# which are merged in the order of the exclusive states.
+		global _build_context
+		_build_context = self
+		log.log(2, "Building {num} states with {jobs} workers", num=len(xstates), jobs=jobs)
+		try:
+			mp_context = multiprocessing.get_context("fork")
+			with ProcessPoolExecutor(max_workers=min(jobs, len(xstates)), mp_context=mp_context) as executor:
+				results = list(executor.map(_build_xstate, [xstate.id for xstate in xstates]))
+		finally:
+			_build_context = None
+
+		for xstate, (result, report) in zip(xstates, results):
+			xstate.restore(self, result)
+			profile.merge(report)
+
+
+_build_context = None
+
+
+def _build_xstate(xstate_id):
+	ctx = _build_context
+	xstate = ctx.xstates[xstate_id]
+	# Drop what the worker inherited or recorded for other states
+	profile.take()
+	xstate.build(ctx)
+	return xstate.result(), profile.take()
 
 
 class Token:
@@ -92,6 +227,8 @@ class Rule:
 		if target_state is None:
 			target_state = xstate
 		self.target_state = target_state
+		# strings of a rule that only matches plain strings, these go into XState.trie
+		self.strings = literals.strings(re)
 		self.xstate.rules.append(self)
 		self.order = len(self.xstate.rules)
 
@@ -101,72 +238,160 @@ class XState:
 		self.id = id
 		self.rules = []
 		self.state_begin = nfa.State()
-		self.dfa_state = None
+		# built instead of the NFA by the followpos engine
+		self.positions = None
+		self.trie = None
+		self.dfa = None
+		self.nonstart_chars = None
+		# (index of the rule, message)
+		self.warnings = []
 
 	def build(self, ctx):
-		compound_re = ReEmpty()
-
+		with profile.phase("xstates", self.id, "nfa"):
+			self.build_nfa(ctx)
+		with profile.phase("xstates", self.id, "build_from_nfa"):
+			full_dfa = self.build_full_dfa()
+		with profile.phase("xstates", self.id, "minimize"):
+			self.dfa = minimize(full_dfa)
+		#vis.visualize(self.dfa)
+
+		if profile.enabled():
+			if self.positions is not None:
+				profile.record("xstates", self.id, positions=len(self.positions.chars), dfa_states=full_dfa.states_num)
+			else:
+				profile.record("xstates", self.id, nfa_states=len(nfa.number_states(self.state_begin)), dfa_states=full_dfa.states_num)
+
+	def fingerprint(self, ctx):
+		"""
+		Digest of everything the automaton is built from: the rules in order, their
+		tokens and target states, and the fragments they refer to. Must be taken
+		before the error rule is added.
+		"""
+		digest = hashlib.sha256()
+		parts = [self.id, ctx.engine]
 		for rule in self.rules:
-			compound_re = ReChoice(rule.re, compound_re)
-
+			parts.extend((rule.token.id, rule.target_state.id, signature(rule.re)))
+		for id, fragment in sorted(ctx.fragment_closure(self.rules).items()):
+			parts.extend((id, signature(fragment.re)))
+		for part in parts:
+			digest.update(part.encode())
+			digest.update(b"\0")
+		return digest.hexdigest()
+
+	def result(self):
+		# Picklable build results, see restore
+		return self.nonstart_chars, self.dfa.pack(), self.warnings
+
+	def restore(self, ctx, result):
+		nonstart_chars, packed_dfa, warnings = result
+		self.add_error_rule(ctx, nonstart_chars)
+		self.dfa = dfa.unpack_dfa(packed_dfa, self.rules)
+		self.warnings = warnings
+
+	def build_nfa(self, ctx):
 		log.log(2, "State {state} has {num} rules", state=self.id, num=len(self.rules))
 
-		def build_rule(rule):
-			state = nfa.State()
-			state.rule = rule
-			rule.re.build_nfa(ctx, self.state_begin, state)
+		rules = self.build_trie()
 
-		for rule in self.rules:
-			build_rule(rule)
+		if ctx.engine == "followpos":
+			self.build_positions(ctx, rules)
+			return
+
+		for rule in rules:
+			self.build_rule(ctx, rule)
+		nfa.expand_calls(self.state_begin)
 
 		nonstart_chars = set(list(range(256)))
+		nonstart_chars.difference_update(self.trie.first_chars())
 
-		visited = set()
-		def visit(state):
-			if state in visited:
-				return
-			visited.add(state)
+		for state in nfa.number_states(self.state_begin, follow_trans=False):
 			for chars, _ in state.trans:
 				nonstart_chars.difference_update(chars)
-			for target_state in state.etrans:
-				visit(target_state)
-
-		visit(self.state_begin)
 
-		# add implicit error rule
-		re_nonstart = ReStar(ReChar(frozenset(nonstart_chars)))
-		error_rule = Rule(self, None, ctx.add_token("error"), ReChoice(re_nonstart, RePrefix(compound_re)))
-		build_rule(error_rule)
+		error_rule = self.add_error_rule(ctx, frozenset(nonstart_chars))
+		self.build_rule(ctx, error_rule)
 
-		full_dfa_state = dfa.build_from_nfa(self.state_begin)
-		full_dfa_state.accepts = None
+	def build_trie(self):
+		# Plain string rules share a trie, the other rules are returned
+		self.trie = literals.Trie()
+		rules = []
+		for rule in self.rules:
+			if rule.strings is not None:
+				for word in rule.strings:
+					self.trie.add(word, rule)
+			else:
+				rules.append(rule)
+		log.log(2, "State {state} has {num} string rules in a trie of {nodes} nodes", state=self.id, num=len(self.rules) - len(rules), nodes=self.trie.nodes_num)
+		return rules
+
+	def build_positions(self, ctx, rules):
+		self.positions = followpos.Positions(ctx)
+		for rule in rules:
+			self.positions.add_rule(rule)
+
+		nonstart_chars = set(range(256)).difference(self.positions.first_chars(), self.trie.first_chars())
+		error_rule = self.add_error_rule(ctx, frozenset(nonstart_chars))
+		self.positions.add_rule(error_rule)
+
+	def build_full_dfa(self):
+		# Subset construction, also finds rules that can never be matched
+		if self.positions is not None:
+			full_dfa = self.positions.build_dfa()
+		else:
+			full_dfa = dfa.build_from_nfa(self.state_begin)
+		if self.trie.nodes_num > 1:
+			# the error rule is the last one
+			full_dfa = self.trie.merge(full_dfa, self.rules[-1])
+		full_dfa.set_accept(0, None)
 
 		marked_rules = set()
 		non_eof_rules = set()
 
-		def mark_rule(state):
-			if state.accepts:
-				marked_rules.add(state.accepts)
+		for state in range(full_dfa.states_num):
+			rule = full_dfa.accept(state)
+			if rule:
+				marked_rules.add(rule)
 
-				for target_state in state.trans:
-					if target_state is None:
-						non_eof_rules.add(state.accepts)
-						break
+				if dfa.NoState in full_dfa.row(state):
+					non_eof_rules.add(rule)
 
-
-		full_dfa_state.visit(mark_rule)
-		for rule in self.rules:
+		# Warnings refer to rules by index, so they stay valid when rules move in the file
+		self.warnings = []
+		for idx, rule in enumerate(self.rules):
 			if rule not in marked_rules:
-				print("{loc}: rule unused in state {state}".format(loc=rule.loc, state=self.id), file=sys.stderr)
+				self.warnings.append((idx, "rule unused in state {state}".format(state=self.id)))
 			elif rule not in non_eof_rules:
-				print("{loc}: in state {state}, this rule is only usable at the end of file".format(loc=rule.loc, state=self.id), file=sys.stderr)
+				self.warnings.append((idx, "in state {state}, this rule is only usable at the end of file".format(state=self.id)))
 
-		self.dfa_state = minimize(full_dfa_state)
-		#vis.visualize(self.dfa_state)
+		return full_dfa
+
+	def build_rule(self, ctx, rule):
+		state = nfa.State()
+		state.rule = rule
+		rule.re.build_nfa(ctx, self.state_begin, state)
+
+	def add_error_rule(self, ctx, nonstart_chars):
+		# add implicit error rule, prefixes of the plain strings are handled by Trie.merge
+		compound_re = ReEmpty()
+
+		for rule in self.rules:
+			if rule.strings is None:
+				compound_re = ReChoice(rule.re, compound_re)
+
+		self.nonstart_chars = nonstart_chars
+		re_nonstart = ReStar(ReChar(nonstart_chars))
+		return Rule(self, None, ctx.add_token("error"), ReChoice(re_nonstart, RePrefix(compound_re)))
+
+	def warning_lines(self):
+		return ["{loc}: {message}".format(loc=self.rules[idx].loc, message=message) for idx, message in self.warnings]
+
+	def report_warnings(self):
+		for line in self.warning_lines():
+			print(line, file=sys.stderr)
 
 class RuleParser(RegexpParser):
-	def __init__(self):
-		super().__init__()
+	def __init__(self, max_repeat):
+		super().__init__(max_repeat)
 
 	def run(self):
 		xstates = []
@@ -205,7 +430,7 @@ class RuleParser(RegexpParser):
 		return (xstates, re, target_state)
 
 
-def parse_rule(source):
-	parser = RuleParser()
+def parse_rule(source, max_repeat=DefaultMaxRepeat):
+	parser = RuleParser(max_repeat)
 	parser.set_source(source)
 	return parser.run()
@@ -1,10 +1,33 @@
 #include <cstdint>
 #include <cstddef>
+#if defined(JLEX_STATS)
+#include <cstdio>
+#endif
 
 $(header)
 
 namespace $(prefix){
 
+#if defined(JLEX_STATS)
+/**
+* Runtime statistics of a lexer, only compiled in when JLEX_STATS is defined
+* JLEX_STATS must be defined the same way everywhere this header is included
+*/
+struct Stats{
+	// input bytes consumed by run
+	uint64_t bytes;
+	// bytes read by run in a state with no transition and nothing to accept (the trap action, 0),
+	// the partial token is dropped and the lexer continues from the first state
+	uint64_t traps;
+	// how many times run read each byte value
+	uint64_t byte_visits[256];
+	// how many bytes were read in each dfa state
+	uint64_t state_visits[$(states_num)];
+	// how many tokens were accepted in each dfa state (including finalize)
+	uint64_t state_accepts[$(states_num)];
+};
+#endif
+
 /**
 * Hold lexer instance state
 */
@@ -19,7 +42,7 @@ struct Lexer{
 	uint32_t state;
 
 	// scratch space for tokens
-    uint32_t* tokens;
+    $(token_buffer_type)* tokens;
     // offset from the begin to the each token's end
     uint32_t* offsets;
     // how many tokens are parsed
@@ -27,6 +50,11 @@ struct Lexer{
 
 $(extra_fields)
 
+#if defined(JLEX_STATS)
+	// counters, see dump_stats
+	Stats stats;
+#endif
+
 };
 
 /**
@@ -42,14 +70,14 @@ $(enum_states)
 /**
 * A list of all tokens
 */
-using TokenID = uint16_t;
+using TokenID = $(token_type);
 
 /// Initializes a lexer
 /// This function is not required, but may be a good idea to use nonetheless
 void init                 ( Lexer* jlex_lexer );
 /// Provides a space for the lexer to put the results into
 /// Both tokens and offsets must have at least that many elements as the size of the input
-void set_buffers          ( Lexer* jlex_lexer, uint32_t* tokens, uint32_t* offsets );
+void set_buffers          ( Lexer* jlex_lexer, $(token_buffer_type)* tokens, uint32_t* offsets );
 /// Provides an input for the lexer
 /// 'End of stream' signal must be provided explicitly with finalize
 void feed                 ( Lexer* jlex_lexer, const uint8_t* data, size_t len, size_t data_offset );
@@ -57,6 +85,11 @@ void feed                 ( Lexer* jlex_lexer, const uint8_t* data, size_t len,
 void set_state            ( Lexer* jlex_lexer, State state );
 /// Runs the lexer (consumes the whole input stream)
 void run                  ( Lexer* jlex_lexer );
+/// Runs the lexer until the input ends or the token buffers (of 'capacity' elements) are nearly full
+/// Returns the offset of the next input byte, if it is not the end of the input,
+/// take the tokens out, call set_buffers and run_bounded again to continue
+/// One element is always left for finalize, so capacity must be at least 2
+size_t run_bounded        ( Lexer* jlex_lexer, size_t capacity );
 /// Tells the lexer that no more input is expected (maybe accepts one more token)
 void finalize             ( Lexer* jlex_lexer );
 /// Returns a pointer to the token stream generated by the lexer
@@ -68,6 +101,14 @@ uint32_t* get_tokens_ends     ( Lexer* jlex_lexer );
 /// Returns the total number of tokens parsed
 size_t get_tokens_count       ( Lexer* jlex_lexer );
 
+#if defined(JLEX_STATS)
+/// Sets all statistics counters to zero, init does this as well
+void reset_stats              ( Lexer* jlex_lexer );
+/// Writes the statistics as text lines: "bytes N", "traps N", "token NAME N" for each token,
+/// "state INDEX VISITS ACCEPTS" for each dfa state and "class INDEX VISITS" for each equivalence class
+void dump_stats               ( const Lexer* jlex_lexer, FILE* out );
+#endif
 
+$(extra_declarations)
 
 }
@@ -0,0 +1,132 @@
+
+#include <algorithm>
+#include <cstring>
+#include <thread>
+#include <vector>
+
+namespace $(prefix){
+
+// run_parallel splits the input into one chunk per thread.
+//
+// The first chunk is lexed from the real lexer state. Other chunks can't know
+// the state they start in, so they are lexed speculatively from a guess, which comes
+// from lexing a few bytes before the chunk. Lexer state and token count are recorded
+// at checkpoints along the chunk.
+//
+// Then chunks are stitched in order. The real state at the start of a chunk is the one
+// at the end of the previous chunk, the chunk is lexed again from it until a checkpoint
+// has the same state as the speculative run. From there, both runs give the same tokens,
+// so the rest of the speculative tokens are moved in place. Lexers forget everything
+// but the exclusive state after a token, so this usually happens at the first checkpoint.
+//
+// There is at most one token per input byte, so chunk k writes its tokens
+// at index + (start of chunk k - offset), and the buffers are as large as for run.
+static const size_t jlex_parallel_lookback = 256;
+static const size_t jlex_parallel_checkpoint = 4096;
+static const size_t jlex_parallel_min_chunk = 65536;
+
+struct JlexChunk{
+	size_t begin;
+	size_t end;
+	// first token index reserved for the chunk
+	size_t tokens_begin;
+	// state and token count (from tokens_begin) at each checkpoint:
+	// at begin, every jlex_parallel_checkpoint bytes, and at end
+	std::vector<uint32_t> states;
+	std::vector<size_t> counts;
+};
+
+static void jlex_run_to ( Lexer* jlex_lexer, size_t end ){
+	jlex_lexer->end_offset = end;
+	run(jlex_lexer);
+}
+
+static void jlex_run_speculative ( Lexer start, JlexChunk* chunk ){
+	Lexer lexer = start;
+
+	// Guess the state at the start of the chunk, tokens are overwritten below
+	// Chunks are larger than the lookback, so it starts inside the input
+	lexer.offset = chunk->begin - jlex_parallel_lookback;
+	lexer.index = chunk->tokens_begin;
+	jlex_run_to(&lexer, chunk->begin);
+	lexer.index = chunk->tokens_begin;
+
+	while ( true ){
+		chunk->states.push_back(lexer.state);
+		chunk->counts.push_back(lexer.index - chunk->tokens_begin);
+		if ( lexer.offset == chunk->end ){
+			break;
+		}
+		jlex_run_to(&lexer, std::min(lexer.offset + jlex_parallel_checkpoint, chunk->end));
+	}
+}
+
+static void jlex_stitch ( Lexer* jlex_lexer, const JlexChunk* chunk ){
+	// jlex_lexer is at the start of the chunk, in the real state
+	for ( size_t i = 0; i < chunk->states.size(); i++ ){
+		if ( jlex_lexer->state == chunk->states[i] ){
+			size_t from = chunk->tokens_begin + chunk->counts[i];
+			size_t count = chunk->counts.back() - chunk->counts[i];
+			memmove(jlex_lexer->tokens + jlex_lexer->index, jlex_lexer->tokens + from, count * sizeof(*jlex_lexer->tokens));
+			memmove(jlex_lexer->offsets + jlex_lexer->index, jlex_lexer->offsets + from, count * sizeof(*jlex_lexer->offsets));
+			jlex_lexer->index += count;
+			jlex_lexer->state = chunk->states.back();
+			jlex_lexer->offset = chunk->end;
+			return;
+		}
+		if ( i + 1 == chunk->states.size() ){
+			break;
+		}
+		// Lexing up to the next checkpoint must not overwrite the speculative tokens after it
+		size_t next = std::min(jlex_lexer->offset + jlex_parallel_checkpoint, chunk->end);
+		if ( jlex_lexer->index + (next - jlex_lexer->offset) > chunk->tokens_begin + chunk->counts[i + 1] ){
+			break;
+		}
+		jlex_run_to(jlex_lexer, next);
+	}
+	// Speculation failed, lex the rest of the chunk
+	jlex_run_to(jlex_lexer, chunk->end);
+}
+
+void run_parallel ( Lexer* jlex_lexer, unsigned threads ){
+	if ( threads == 0 ){
+		threads = std::thread::hardware_concurrency();
+	}
+#if defined(JLEX_STATS)
+	// Speculative runs would be counted too, statistics are only exact for run
+	threads = 1;
+#endif
+	size_t begin = jlex_lexer->offset;
+	size_t end = jlex_lexer->end_offset;
+	size_t chunks_num = std::min((size_t)threads, (end - begin) / jlex_parallel_min_chunk);
+	if ( chunks_num <= 1 ){
+		run(jlex_lexer);
+		return;
+	}
+
+	size_t chunk_size = (end - begin) / chunks_num;
+	std::vector<JlexChunk> chunks(chunks_num);
+	for ( size_t k = 0; k < chunks_num; k++ ){
+		chunks[k].begin = begin + k * chunk_size;
+		chunks[k].end = k + 1 == chunks_num ? end : chunks[k].begin + chunk_size;
+		chunks[k].tokens_begin = jlex_lexer->index + k * chunk_size;
+		chunks[k].states.reserve((chunks[k].end - chunks[k].begin) / jlex_parallel_checkpoint + 2);
+		chunks[k].counts.reserve((chunks[k].end - chunks[k].begin) / jlex_parallel_checkpoint + 2);
+	}
+
+	std::vector<std::thread> workers;
+	for ( size_t k = 1; k < chunks_num; k++ ){
+		workers.emplace_back(jlex_run_speculative, *jlex_lexer, &chunks[k]);
+	}
+	jlex_run_to(jlex_lexer, chunks[0].end);
+	for ( std::thread& worker : workers ){
+		worker.join();
+	}
+
+	for ( size_t k = 1; k < chunks_num; k++ ){
+		jlex_stitch(jlex_lexer, &chunks[k]);
+	}
+	jlex_lexer->end_offset = end;
+}
+
+}
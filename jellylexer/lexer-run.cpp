@@ -0,0 +1,157 @@
+void init      ( Lexer* jlex_lexer ){
+	jlex_lexer->offset = 0;
+	jlex_lexer->end_offset = 0;
+	jlex_lexer->base_ptr = 0;
+
+	jlex_lexer->state = 0;
+	jlex_lexer->tokens = nullptr;
+	jlex_lexer->offsets = nullptr;
+	jlex_lexer->index = 0;
+#if defined(JLEX_STATS)
+	reset_stats(jlex_lexer);
+#endif
+}
+
+void set_buffers ( Lexer* jlex_lexer, $(token_buffer_type)* tokens, uint32_t* offsets ){
+	jlex_lexer->tokens = tokens;
+	jlex_lexer->offsets = offsets;
+	jlex_lexer->index = 0;
+}
+
+void feed       ( Lexer* jlex_lexer, const uint8_t* data, size_t len, size_t data_offset ){
+	jlex_lexer->offset = data_offset;
+	jlex_lexer->base_ptr = ((uintptr_t)data) - data_offset;
+	jlex_lexer->end_offset = data_offset + len;
+}
+
+void set_state ( Lexer* jlex_lexer, State state ){
+	switch ( state ){
+	$(set_state_switch)
+	}
+}
+
+#if defined(__GNUC__)
+#	define jlex_unlikely(e) __builtin_expect((e), 0)
+#else
+#	define jlex_unlikely(e) (e)
+#endif
+
+void run       ( Lexer* jlex_lexer ){
+	// Copy stuff from jlex_lexer intro local variables
+	// so wed dont confuse optimizer with false aliasing
+
+	uintptr_t jlex_input_base = jlex_lexer->base_ptr;
+$(run_tables)
+	uint32_t jlex_state = jlex_lexer->state;
+	$(token_buffer_type)* __restrict jlex_tokens = jlex_lexer->tokens;
+	uint32_t* __restrict jlex_offsets = jlex_lexer->offsets;
+
+	size_t jlex_offset = jlex_lexer->offset;
+	size_t jlex_max = jlex_lexer->end_offset;
+
+	// Current output token offset in bytes
+	size_t jlex_token_idx = jlex_lexer->index * 4;
+
+#if defined(JLEX_STATS)
+	Stats* jlex_stats = &jlex_lexer->stats;
+#endif
+
+	// This will only mispredict at the end of input
+	while ( jlex_offset < jlex_max ){
+		// Decode equivalence class of the next input byte
+		uint32_t jlex_eq =  jlex_eq_class[*(const uint8_t*)(jlex_input_base + jlex_offset)];
+		// Decode the nex action
+		$(action_type) jlex_state_next = jlex_transitions[jlex_state + jlex_eq];
+#if defined(JLEX_STATS)
+		jlex_stats->byte_visits[*(const uint8_t*)(jlex_input_base + jlex_offset)]++;
+		jlex_stats->state_visits[jlex_state]++;
+		jlex_stats->state_accepts[jlex_state] += $(accept_step) >> 2u;
+		jlex_stats->traps += jlex_state_next == 0;
+#endif
+		// Write to the current output token
+		// It only becomes a token if the action is ACCEPT, see convert_tokens_ids
+		*(uint32_t*)((const char*)jlex_offsets + jlex_token_idx) = (uint32_t)(jlex_offset);
+		*($(token_buffer_type)*)((const char*)jlex_tokens + $(token_offset)) = $(action_token);
+
+		// Extract lower part of the action (next dfa state)
+		jlex_state = jlex_state_next & $(state_mask);
+
+		// Advance jlex_token_idx by 4 if the action is ACCEPT
+		jlex_token_idx += $(accept_step);
+
+		// Go to the next byte
+		jlex_offset++;
+	}
+
+$(lexer_trap)
+
+#if defined(JLEX_STATS)
+	jlex_stats->bytes += jlex_offset - jlex_lexer->offset;
+#endif
+
+	// Fixup lexer fields
+	jlex_lexer->state = jlex_state;
+	jlex_lexer->offset = jlex_offset;
+	jlex_lexer->index = jlex_token_idx / 4;
+}
+
+// Stops early when fewer free tokens than this are left
+static const size_t jlex_bounded_min_room = 256;
+
+size_t run_bounded ( Lexer* jlex_lexer, size_t capacity ){
+	size_t jlex_end = jlex_lexer->end_offset;
+	// Small buffers are used up to the half, so every call with an empty buffer makes progress
+	size_t jlex_min_room = capacity / 2 < jlex_bounded_min_room ? capacity / 2 : jlex_bounded_min_room;
+
+	// Each byte adds at most one token, run the input in parts that surely fit.
+	// One token is kept free for finalize
+	while ( jlex_lexer->offset < jlex_end && jlex_lexer->index + 1 < capacity ){
+		size_t jlex_room = capacity - jlex_lexer->index - 1;
+		if ( jlex_room < jlex_min_room && jlex_room < jlex_end - jlex_lexer->offset ){
+			break;
+		}
+		jlex_lexer->end_offset = jlex_end - jlex_lexer->offset < jlex_room ? jlex_end : jlex_lexer->offset + jlex_room;
+		run(jlex_lexer);
+	}
+
+	jlex_lexer->end_offset = jlex_end;
+	return jlex_lexer->offset;
+}
+
+void finalize  ( Lexer* jlex_lexer ){
+	// Parse the 'end of stream' pseudo character
+	// Repeats run function, but uses jlex_eof_transitions instead
+$(finalize_tables)
+	uint32_t jlex_state = jlex_lexer->state;
+	$(token_buffer_type)* __restrict jlex_tokens = jlex_lexer->tokens;
+	uint32_t* __restrict jlex_offsets = jlex_lexer->offsets;
+	size_t jlex_token_idx = jlex_lexer->index * 4;
+	size_t jlex_offset = jlex_lexer->offset;
+
+	$(action_type) jlex_state_next = jlex_eof_transitions[jlex_state];
+#if defined(JLEX_STATS)
+	jlex_lexer->stats.state_accepts[jlex_state] += $(accept_step) >> 2u;
+#endif
+	*($(token_buffer_type)*)((const char*)jlex_tokens + $(token_offset)) = $(action_token);
+	*(uint32_t*)((const char*)jlex_offsets + jlex_token_idx) = (uint32_t)(jlex_offset);
+	jlex_state = jlex_state_next & $(state_mask);
+	jlex_token_idx += $(accept_step);
+
+	jlex_lexer->state = jlex_state;
+	jlex_lexer->index = jlex_token_idx / 4;
+}
+
+TokenID* convert_tokens_ids ( Lexer* jlex_lexer ){
+$(convert_tokens)
+	return (TokenID*)jlex_lexer->tokens;
+}
+
+size_t get_tokens_count   ( Lexer* jlex_lexer ){
+	return jlex_lexer->index;
+}
+
+uint32_t* get_tokens_ends ( Lexer* jlex_lexer ){
+	return jlex_lexer->offsets;
+}
+
+}
\ No newline at end of file
@@ -0,0 +1,57 @@
+
+#if defined(JLEX_STATS)
+
+namespace $(prefix){
+
+// Statistics are counted by dfa state and by byte value, these tables map them
+// back to the grammar: the token accepted in each dfa state (an index in
+// jlex_stats_token_names, 0xffff if the state does not accept) and the
+// equivalence class of each byte value.
+static const char* const jlex_stats_token_names[] = {
+$(token_names)
+};
+static const uint16_t jlex_stats_state_tokens[] = {
+$(stats_state_tokens)
+};
+static const uint8_t jlex_stats_byte_classes[256] = {
+$(stats_byte_classes)
+};
+
+static const size_t jlex_stats_tokens_num = sizeof(jlex_stats_token_names) / sizeof(jlex_stats_token_names[0]);
+static const size_t jlex_stats_states_num = $(states_num);
+static const size_t jlex_stats_classes_num = $(classes_num);
+
+void reset_stats ( Lexer* jlex_lexer ){
+	jlex_lexer->stats = Stats();
+}
+
+void dump_stats ( const Lexer* jlex_lexer, FILE* out ){
+	const Stats* stats = &jlex_lexer->stats;
+
+	uint64_t tokens[jlex_stats_tokens_num] = {};
+	for ( size_t i = 0; i < jlex_stats_states_num; i++ ){
+		if ( jlex_stats_state_tokens[i] < jlex_stats_tokens_num ){
+			tokens[jlex_stats_state_tokens[i]] += stats->state_accepts[i];
+		}
+	}
+	uint64_t classes[jlex_stats_classes_num] = {};
+	for ( size_t i = 0; i < 256; i++ ){
+		classes[jlex_stats_byte_classes[i]] += stats->byte_visits[i];
+	}
+
+	fprintf(out, "bytes %llu\n", (unsigned long long)stats->bytes);
+	fprintf(out, "traps %llu\n", (unsigned long long)stats->traps);
+	for ( size_t i = 0; i < jlex_stats_tokens_num; i++ ){
+		fprintf(out, "token %s %llu\n", jlex_stats_token_names[i], (unsigned long long)tokens[i]);
+	}
+	for ( size_t i = 0; i < jlex_stats_states_num; i++ ){
+		fprintf(out, "state %zu %llu %llu\n", i, (unsigned long long)stats->state_visits[i], (unsigned long long)stats->state_accepts[i]);
+	}
+	for ( size_t i = 0; i < jlex_stats_classes_num; i++ ){
+		fprintf(out, "class %zu %llu\n", i, (unsigned long long)classes[i]);
+	}
+}
+
+}
+
+#endif
@@ -0,0 +1,201 @@
+}
+
+#include <cstring>
+#include <fcntl.h>
+#include <sys/mman.h>
+#include <sys/stat.h>
+#include <unistd.h>
+
+#if defined(JLEX_STATS)
+#error JLEX_STATS needs the tables compiled in, generate the lexer without --tables
+#endif
+
+namespace $(prefix){
+
+// Lexer tables are loaded at runtime from a table file, see load_tables.
+//
+// The file is an array of 32-bit words in the native byte order:
+//   header (10 words): "JLEXTBLS", version, byte order mark 0x01020304,
+//                      classes, states, tokens, exclusive states, names size, reserved
+//   eq_class[256]
+//   transitions[classes * states]
+//   eof_transitions[states]
+//   initial state of each exclusive state
+// followed by the token names and the exclusive state names as zero terminated strings.
+// Tables have the same layout as the static tables of the lexer,
+// except the token field of an action is the index of the token name in the file.
+static const uint32_t jlex_tables_version = $(tables_version);
+static const size_t jlex_tables_header_words = 10;
+
+// Tokens and states this lexer was compiled with, tables are matched to them by name
+static const char* const jlex_token_names[] = {
+$(token_names)
+};
+static const TokenID jlex_token_values[] = {
+$(token_values)
+};
+static const char* const jlex_state_names[] = {
+$(state_names)
+};
+
+static const size_t jlex_tokens_num = sizeof(jlex_token_names) / sizeof(jlex_token_names[0]);
+static const size_t jlex_states_num = sizeof(jlex_state_names) / sizeof(jlex_state_names[0]);
+
+static bool jlex_check_action ( uint32_t action, size_t states_num, size_t tokens_num ){
+	// The next state must be a valid index
+	return ((action >> 19) & 0xfffu) < tokens_num
+		&& (action & 0x7ffffu) < states_num;
+}
+
+static const char* jlex_next_name ( const char* name, const char* names_end ){
+	while ( name < names_end && *name != 0 ){
+		name++;
+	}
+	return name < names_end ? name + 1 : nullptr;
+}
+
+bool load_tables_from_memory ( Tables* tables, const void* data, size_t size ){
+	tables->eq_class = nullptr;
+	tables->transitions = nullptr;
+	tables->eof_transitions = nullptr;
+	tables->token_ids = nullptr;
+	tables->mapping = nullptr;
+	tables->mapping_size = 0;
+
+	const uint32_t* words = (const uint32_t*)data;
+	if ( size < jlex_tables_header_words * 4 || ((uintptr_t)data) % 4 != 0 ){
+		return false;
+	}
+	if ( memcmp(data, "JLEXTBLS", 8) != 0 || words[2] != jlex_tables_version || words[3] != 0x01020304u ){
+		return false;
+	}
+
+	size_t classes_num = words[4];
+	size_t states_num = words[5];
+	size_t tokens_num = words[6];
+	size_t xstates_num = words[7];
+	size_t names_size = words[8];
+
+	// State indices must fit into the state field of an action
+	if ( classes_num == 0 || classes_num > 256 || states_num == 0 || states_num > 0x80000u ){
+		return false;
+	}
+	if ( tokens_num == 0 || tokens_num > 0x1000u || xstates_num == 0 ){
+		return false;
+	}
+
+	size_t table_size = classes_num * states_num;
+	size_t words_num = jlex_tables_header_words + 256 + table_size + states_num + xstates_num;
+	if ( xstates_num > size || names_size > size || words_num * 4 + names_size != size ){
+		return false;
+	}
+
+	const uint32_t* eq_class = words + jlex_tables_header_words;
+	const uint32_t* transitions = eq_class + 256;
+	const uint32_t* eof_transitions = transitions + table_size;
+	const uint32_t* xstates = eof_transitions + states_num;
+	const char* names = (const char*)(xstates + xstates_num);
+	const char* names_end = names + names_size;
+
+	for ( size_t i = 0; i < 256; i++ ){
+		if ( eq_class[i] % states_num != 0 || eq_class[i] >= table_size ){
+			return false;
+		}
+	}
+	// eof_transitions directly follow transitions
+	for ( size_t i = 0; i < table_size + states_num; i++ ){
+		if ( !jlex_check_action(transitions[i], states_num, tokens_num) ){
+			return false;
+		}
+	}
+
+	TokenID* token_ids = new TokenID[tokens_num];
+	const char* name = names;
+	for ( size_t i = 0; i < tokens_num; i++ ){
+		const char* next = jlex_next_name(name, names_end);
+		size_t j = 0;
+		while ( next && j < jlex_tokens_num && strcmp(name, jlex_token_names[j]) != 0 ){
+			j++;
+		}
+		if ( !next || j == jlex_tokens_num ){
+			// unknown token, the lexer needs to be rebuilt with the grammar
+			delete[] token_ids;
+			return false;
+		}
+		token_ids[i] = jlex_token_values[j];
+		name = next;
+	}
+
+	bool found[jlex_states_num] = {};
+	for ( size_t i = 0; i < xstates_num; i++ ){
+		const char* next = jlex_next_name(name, names_end);
+		if ( !next || xstates[i] >= states_num ){
+			delete[] token_ids;
+			return false;
+		}
+		for ( size_t j = 0; j < jlex_states_num; j++ ){
+			if ( strcmp(name, jlex_state_names[j]) == 0 ){
+				tables->states[j] = xstates[i];
+				found[j] = true;
+			}
+		}
+		name = next;
+	}
+	for ( size_t j = 0; j < jlex_states_num; j++ ){
+		if ( !found[j] ){
+			delete[] token_ids;
+			return false;
+		}
+	}
+
+	tables->eq_class = eq_class;
+	tables->transitions = transitions;
+	tables->eof_transitions = eof_transitions;
+	tables->token_ids = token_ids;
+	return true;
+}
+
+bool load_tables ( Tables* tables, const char* path ){
+	int fd = open(path, O_RDONLY);
+	if ( fd < 0 ){
+		return false;
+	}
+	struct stat st;
+	if ( fstat(fd, &st) != 0 || st.st_size <= 0 ){
+		close(fd);
+		return false;
+	}
+	size_t size = (size_t)st.st_size;
+	// Read only shared mapping, all processes using the file share its pages
+	void* mapping = mmap(nullptr, size, PROT_READ, MAP_SHARED, fd, 0);
+	close(fd);
+	if ( mapping == MAP_FAILED ){
+		return false;
+	}
+	if ( !load_tables_from_memory(tables, mapping, size) ){
+		munmap(mapping, size);
+		return false;
+	}
+	tables->mapping = mapping;
+	tables->mapping_size = size;
+	return true;
+}
+
+void unload_tables ( Tables* tables ){
+	delete[] tables->token_ids;
+	tables->token_ids = nullptr;
+	if ( tables->mapping ){
+		munmap(tables->mapping, tables->mapping_size);
+		tables->mapping = nullptr;
+		tables->mapping_size = 0;
+	}
+	tables->eq_class = nullptr;
+	tables->transitions = nullptr;
+	tables->eof_transitions = nullptr;
+}
+
+void set_tables ( Lexer* jlex_lexer, const Tables* tables ){
+	jlex_lexer->tables = tables;
+	jlex_lexer->state = tables->states[0];
+}
+
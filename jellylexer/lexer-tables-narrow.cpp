@@ -0,0 +1,30 @@
+// Equivalence class for each input byte value.
+// Lexer does not distinguish most of the input characters, like '4' and '5'
+// Generator puts such characters into the same class to compress transition tables.
+// Values in this table are indices in the jlex_transitions table (class * number of states).
+static const uint32_t jlex_eq_class[256] = {
+$(eq_classes)
+};
+
+// Transition tables for the lexer. Each value describes how to act in a certain state,
+// when certain character (equivalence class) is encountered.
+//
+// In bit representation:
+//   XYYYYYYY YYYYYYYY
+// X is 1 for ACCEPT, and 0 for CONTINUE
+// YYYs are the next dfa state (index in the tables indexed by state)
+//
+// On ACCEPT, the token is the one of the current state, from jlex_state_tokens.
+static const uint16_t jlex_transitions[] = {
+$(transitions)
+};
+
+// Transition table for end of file pseudo character class
+static const uint16_t jlex_eof_transitions[] = {
+$(eof_transitions)
+};
+
+// Token accepted in each state, only used when the action is ACCEPT
+static const TokenID jlex_state_tokens[] = {
+$(state_tokens)
+};
@@ -0,0 +1,193 @@
+import re
+from jellylexer.regexp import *
+from jellylexer.dfa import DFA, NoState
+from jellylib.parsing import *
+
+# Words of a word list are runs of printable characters other than space
+WordRegexp = re.compile("[!-~]+")
+SpacesRegexp = re.compile("[\n\r\t ]*")
+
+
+def literal(re):
+	# Bytes of a plain string like "while" or \+\+, or None
+	word = []
+	for part in flatten(re, ReConcat):
+		if isinstance(part, ReChar) and len(part.chars) == 1:
+			word.extend(part.chars)
+		elif not isinstance(part, ReEmpty):
+			return None
+	if not word:
+		return None
+	return bytes(word)
+
+
+def strings(re):
+	"""
+	Returns the strings re matches if it is a plain string or a choice of plain
+	strings, like "if" | "else", otherwise returns None.
+	"""
+	words = []
+	for part in flatten(re, ReChoice):
+		word = literal(part)
+		if word is None:
+			return None
+		words.append(word)
+	return words
+
+
+# Regexps are never changed once built, so words of a word list share these
+ByteRes = [ReChar([char]) for char in range(256)]
+
+
+def word_re(word):
+	# The regexp the parser makes for "word"
+	re = ReEmpty()
+	for char in word:
+		re = ReConcat(re, ByteRes[char])
+	return re
+
+
+def words_re(words):
+	re = word_re(words[0])
+	for word in words[1:]:
+		re = ReChoice(re, word_re(word))
+	return re
+
+
+class WordListParser(Parser):
+	def run(self):
+		words = []
+		while True:
+			self.match(SpacesRegexp)
+			if self.is_eof():
+				return words
+			word = self.match(WordRegexp)
+			if word is None:
+				self.report("unexpected character in word list")
+			words.append(word.encode())
+
+
+def parse_words(span):
+	# Whitespace separated words of span, as bytes
+	parser = WordListParser()
+	parser.set_source(span)
+	return parser.run()
+
+
+class Trie:
+	"""
+	Plain string rules of an exclusive state, merged by their common prefixes.
+
+	Node 0 is the root. children[node] maps a byte to the next node, rules[node]
+	is the rule of the string that ends at node, the first one declared if the
+	same string has several.
+	"""
+
+	def __init__(self):
+		self.children = [dict()]
+		self.rules = [None]
+
+	@property
+	def nodes_num(self):
+		return len(self.rules)
+
+	def first_chars(self):
+		return self.children[0].keys()
+
+	def add(self, word, rule):
+		node = 0
+		for char in word:
+			next_node = self.children[node].get(char)
+			if next_node is None:
+				next_node = len(self.rules)
+				self.children[node][char] = next_node
+				self.children.append(dict())
+				self.rules.append(None)
+			node = next_node
+		if self.rules[node] is None or rule.order < self.rules[node].order:
+			self.rules[node] = rule
+
+	def shared_suffixes(self):
+		"""
+		Returns the node that stands for each node once equal subtrees are merged,
+		so strings with a common ending share it as they would in a minimized
+		automaton. Children are added after their parents, so they are merged first.
+		"""
+		shared = list(range(len(self.rules)))
+		subtrees = dict()
+		for node in reversed(range(len(self.rules))):
+			key = (self.rules[node], tuple(sorted((char, shared[child]) for char, child in self.children[node].items())))
+			shared[node] = subtrees.setdefault(key, node)
+		return shared
+
+	def merge(self, base, prefix_rule):
+		"""
+		Returns the product of base, the automaton of the other rules, and the trie.
+		A state is a pair of a base state and a trie node, either may be missing,
+		and accepts the first declared of their rules. Trie nodes where no string
+		ends accept prefix_rule, this is the RePrefix part of the error rule.
+		Bytes the trie uses get classes of their own, the rest keep those of base.
+		"""
+		shared = self.shared_suffixes()
+
+		trie_chars = set()
+		for children in self.children:
+			trie_chars.update(children)
+
+		keys = dict()
+		class_map = []
+		for char in range(256):
+			key = (base.class_map[char], char if char in trie_chars else -1)
+			class_map.append(keys.setdefault(key, len(keys)))
+		classes_num = len(keys)
+		base_classes = [base_clss for base_clss, _ in keys]
+
+		out = DFA(class_map, classes_num)
+		base_k = base.classes_num
+		base_rows = dict()
+
+		pairs = [(0, 0)]
+		pair_ids = {(0, 0): 0}
+		i = 0
+		while i < len(pairs):
+			state, node = pairs[i]
+			i += 1
+
+			if state != NoState:
+				base_row = base_rows.get(state)
+				if base_row is None:
+					begin = state * base_k
+					base_row = base_rows[state] = [base.trans[begin + clss] for clss in base_classes]
+			else:
+				base_row = None
+
+			next_nodes = dict()
+			if node != NoState:
+				for char, child in self.children[node].items():
+					next_nodes[class_map[char]] = shared[child]
+
+			dfa_state = out.add_state()
+			row = out.empty_row()
+			for clss in range(classes_num):
+				target_state = base_row[clss] if base_row is not None else NoState
+				target_node = next_nodes.get(clss, NoState)
+				if target_state == NoState and target_node == NoState:
+					continue
+				pair = (target_state, target_node)
+				target = pair_ids.get(pair)
+				if target is None:
+					target = pair_ids[pair] = len(pairs)
+					pairs.append(pair)
+				row[clss] = target
+
+			begin = dfa_state * classes_num
+			out.trans[begin:begin + classes_num] = row
+
+			accept = base.accept(state) if state != NoState else None
+			if node != NoState and node != 0:
+				rule = self.rules[node] or prefix_rule
+				if accept is None or rule.order < accept.order:
+					accept = rule
+			out.set_accept(dfa_state, accept)
+
+		return out
@@ -1,8 +1,11 @@
 class State:
 	def __init__(self):
+		self.id = None
 		self.etrans = []
 		self.trans = []
 		self.rule = None
+		# Template this state calls, see add_call
+		self.template = None
 
 	def add_etrans(self, state):
 		self.etrans.append(state)
@@ -11,33 +14,95 @@ class State:
 		self.trans.append((chars, state))
 
 	def visit(self, visitor):
-		visited = set()
-
-		def _visit(state):
-			if state in visited:
-				return
-			visited.add(state)
+		for state in number_states(self):
 			visitor(state)
-			for target_state in state.etrans:
-				_visit(target_state)
+
+
+def number_states(begin, follow_trans=True):
+	"""
+	Assigns dense ids to all states reachable from begin, in breadth first order.
+	Returns the list of states, where states[state.id] is state.
+	With follow_trans=False, only epsilon transitions are followed.
+	"""
+	begin.id = 0
+	states = [begin]
+	seen = {begin}
+	i = 0
+	while i < len(states):
+		state = states[i]
+		for target_state in state.etrans:
+			if target_state not in seen:
+				seen.add(target_state)
+				target_state.id = len(states)
+				states.append(target_state)
+		if follow_trans:
 			for chars, target_state in state.trans:
-				_visit(target_state)
+				if target_state not in seen:
+					seen.add(target_state)
+					target_state.id = len(states)
+					states.append(target_state)
+		i += 1
+	return states
 
-		_visit(self)
 
+class Template:
+	"""
+	Flat copy of an NFA fragment between begin and end.
+	States are numbered once, so instantiating the fragment is a linear pass
+	over the edge lists, without walking the original graph again.
 
-def clone(begin, end):
-	remap = dict()
+	Fragments the fragment refers to are kept as calls, (template, begin, end)
+	with state indices, instead of copies of their states: a template is as large
+	as its own regexp, however deeply fragments are nested.
+	"""
+
+	def __init__(self, begin, end):
+		states = number_states(begin)
+		self.size = len(states)
+		self.end = end.id
+		self.etrans = []
+		self.calls = []
+		for state in states:
+			if state.template is not None:
+				# the edge of a call only keeps its end reachable, it is not copied
+				self.etrans.append([])
+				self.calls.append((state.template, state.id, state.etrans[0].id))
+			else:
+				self.etrans.append([target_state.id for target_state in state.etrans])
+		self.trans = [[(chars, target_state.id) for chars, target_state in state.trans] for state in states]
+
+	def instantiate(self, begin, end):
+		# Calls of nested templates are expanded from a work list, not recursively
+		pending = [(self, begin, end)]
+		while pending:
+			template, begin, end = pending.pop()
+			states = [State() for i in range(template.size)]
+			for state, etrans, trans in zip(states, template.etrans, template.trans):
+				state.etrans = [states[idx] for idx in etrans]
+				state.trans = [(chars, states[idx]) for chars, idx in trans]
+			begin.add_etrans(states[0])
+			states[template.end].add_etrans(end)
+			for nested, call_begin, call_end in template.calls:
+				pending.append((nested, states[call_begin], states[call_end]))
+
+
+def add_call(begin, end, template):
+	"""
+	Puts a call of template between begin and end: a state that stands for an
+	instance of the template until expand_calls replaces it.
+	"""
+	call = State()
+	call.template = template
+	call.add_etrans(end)
+	begin.add_etrans(call)
 
-	def get_clone(state):
-		if state in remap:
-			return remap[state]
-		new_state = State()
-		remap[state] = new_state
-		for target_state in state.etrans:
-			new_state.etrans.append(get_clone(target_state))
-		for chars, target_state in state.trans:
-			new_state.trans.append((chars, get_clone(target_state)))
-		return new_state
 
-	return get_clone(begin), get_clone(end)
\ No newline at end of file
+def expand_calls(begin):
+	# Instantiates the calls reachable from begin, instances have no calls left
+	for state in number_states(begin):
+		if state.template is not None:
+			end = state.etrans[0]
+			template = state.template
+			state.template = None
+			state.etrans = []
+			template.instantiate(state, end)
@@ -1,6 +1,8 @@
+import re
 from jellylib.parsing import *
 from jellylexer.grammar import *
-from jellylexer.regexp_parser import parse_span
+from jellylexer.regexp_parser import parse_span, DefaultMaxRepeat
+from jellylexer.literals import parse_words, words_re
 
 class Section:
 	def __init__(self, project, loc, name, params):
@@ -29,6 +31,7 @@ class Project:
 		self.name = name
 		self.sections = []
 		self.grammar = GrammarContext()
+		self.max_repeat = DefaultMaxRepeat
 
 	def check_used(self):
 		for section in self.sections:
@@ -43,6 +46,11 @@ class Project:
 				if value.key == "state":
 					name = parse_string(value.span).strip()
 					self.grammar.add_xstate(XState(name))
+				elif value.key == "max-repeat":
+					limit = parse_string(value.span).strip()
+					if not limit.isdigit():
+						raise Error(value.loc, "expected number")
+					self.max_repeat = int(limit)
 				else:
 					raise Error(value.loc, "unknown key")
 
@@ -50,14 +58,36 @@ class Project:
 			section.mark_used()
 
 			for value in section.values:
-				re = parse_span(value.span)
+				re = parse_span(value.span, self.max_repeat)
 				self.grammar.add_fragment(Fragment(value.key, value.loc, re))
 
+		# Keywords come before the grammar, so they take precedence over its rules
+		for section in self.get_sections("keywords"):
+			section.mark_used()
+
+			xstates = dict()
+			for name in section.params:
+				if name == "all":
+					xstates.update(self.grammar.xstates)
+				else:
+					xstates[name] = self.grammar.get_xstate(section.loc, name)
+			if len(xstates) == 0:
+				xstates["default"] = self.grammar.get_xstate(None, "default")
+
+			for value in section.values:
+				words = parse_words(value.span)
+				if len(words) == 0:
+					raise Error(value.loc, "empty word list")
+				re = words_re(words)
+				token = self.grammar.add_token(value.key)
+				for xstate in xstates.values():
+					Rule(xstate, value.loc, token, re)
+
 		for section in self.get_sections("grammar"):
 			section.mark_used()
 
 			for value in section.values:
-				xstates, re, target_state_name = parse_rule(value.span)
+				xstates, re, target_state_name = parse_rule(value.span, self.max_repeat)
 				rule_xstates = set()
 				for loc, xstate_name in xstates:
 					if xstate_name == "all":
@@ -75,8 +105,8 @@ class Project:
 				for xstate in rule_xstates:
 					Rule(xstate, value.loc, token, re, target_state)
 
-	def build(self):
-		self.grammar.build()
+	def build(self, jobs=1, cache=None):
+		self.grammar.build(jobs, cache)
 
 	def get_sections(self, name, params=None):
 		for section in self.sections:
@@ -97,6 +127,10 @@ class Project:
 
 WordChar = LowerLetter | UpperLetter | Digit | frozenset("_-+")
 
+WordRegexp = re.compile("[a-zA-Z0-9_+\\-]+")
+WhitespaceRegexp = re.compile("[ \t]+")
+RestOfLineRegexp = re.compile("[^\r\n]*")
+
 
 class ProjectParser(Parser):
 	def __init__(self, project, source):
@@ -228,14 +262,10 @@ class ProjectParser(Parser):
 			self.report("unexpected indented value")
 		pos_begin = pos
 		pos_end = pos_begin
-		while True:
-			ch = self.peek()
-			if ch in LineEnd:
-				break
-			else:
-				self.take()
-				if ch not in Whitespaces:
-					pos_end = self.tell()
+		line_begin = self.tell()
+		line = self.match(RestOfLineRegexp).rstrip(" \t")
+		if line:
+			pos_end = line_begin + len(line)
 		self.consume_newline()
 		if not self.active_value_span_empty:
 			self.add_newline()
@@ -255,28 +285,16 @@ class ProjectParser(Parser):
 			self.active_indent = None
 
 	def consume_comment_line(self):
-		while True:
-			ch = self.peek()
-			if ch in Newlines:
-				self.consume_newline()
-				return
-			elif ch == EOF:
-				return
-			else:
-				self.take()
+		self.match(RestOfLineRegexp)
+		self.consume_newline()
 
 	def consume_empty_line(self):
-		while True:
-			ch = self.peek()
-			if ch in Newlines:
-				self.consume_newline()
-				return
-			elif ch == EOF:
-				return
-			elif ch in Whitespaces:
-				self.take()
-			else:
-				self.report("unexpected character, expected empty line")
+		self.skip_ws()
+		ch = self.peek()
+		if ch in Newlines:
+			self.consume_newline()
+		elif ch != EOF:
+			self.report("unexpected character, expected empty line")
 
 	def consume_newline(self):
 		ch = self.peek()
@@ -288,25 +306,14 @@ class ProjectParser(Parser):
 				self.take()
 
 	def parse_word(self):
-		chars = []
 		begin = self.loc()
-		while True:
-			ch = self.peek()
-			if ch not in WordChar:
-				break
-			self.take()
-			chars.append(ch)
-		if len(chars) == 0:
+		word = self.match(WordRegexp)
+		if word is None:
 			self.report("expected word")
-		return ''.join(chars), begin.to(self.loc())
+		return word, begin.to(self.loc())
 
 	def skip_ws(self):
-		while True:
-			ch = self.peek()
-			if ch in Whitespaces:
-				self.advance()
-			else:
-				return
+		self.match(WhitespaceRegexp)
 
 
 def parse_project(source, name):
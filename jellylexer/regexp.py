@@ -33,9 +33,13 @@ class ReConcat:
 		self.right = right
 
 	def build_nfa(self, ctx, begin, end):
-		mid = nfa.State()
-		self.left.build_nfa(ctx, begin, mid)
-		self.right.build_nfa(ctx, mid, end)
+		parts = flatten(self, ReConcat)
+		state = begin
+		for part in parts[:-1]:
+			mid = nfa.State()
+			part.build_nfa(ctx, state, mid)
+			state = mid
+		parts[-1].build_nfa(ctx, state, end)
 
 
 class ReStar:
@@ -54,24 +58,38 @@ class ReStar:
 		self.re.build_nfa(ctx, mid_begin, mid_end)
 
 
+class ReRepeat:
+	def __init__(self, re, min, max):
+		self.re = re
+		self.min = min
+		self.max = max
+
+	def build_nfa(self, ctx, begin, end):
+		# A chain of max copies, every copy after the first min ones may be skipped to the end
+		state = begin
+		for i in range(self.max):
+			if i >= self.min:
+				state.add_etrans(end)
+			next_state = nfa.State()
+			self.re.build_nfa(ctx, state, next_state)
+			state = next_state
+		state.add_etrans(end)
+
+
 class ReChoice:
 	def __init__(self, left, right):
 		self.left = left
 		self.right = right
 
 	def build_nfa(self, ctx, begin, end):
-		left_begin = nfa.State()
-		left_end = nfa.State()
-		right_begin = nfa.State()
-		right_end = nfa.State()
+		for part in flatten(self, ReChoice):
+			part_begin = nfa.State()
+			part_end = nfa.State()
 
-		begin.add_etrans(left_begin)
-		begin.add_etrans(right_begin)
-		left_end.add_etrans(end)
-		right_end.add_etrans(end)
+			begin.add_etrans(part_begin)
+			part_end.add_etrans(end)
 
-		self.left.build_nfa(ctx, left_begin, left_end)
-		self.right.build_nfa(ctx, right_begin, right_end)
+			part.build_nfa(ctx, part_begin, part_end)
 
 
 class RePrefix:
@@ -82,10 +100,97 @@ class RePrefix:
 		mid_begin = nfa.State()
 		mid_end = nfa.State()
 		self.re.build_nfa(ctx, mid_begin, mid_end)
+		# every state of re gets an edge, including those of the fragments it uses
+		nfa.expand_calls(mid_begin)
 
-		def visitor(state):
+		# States of re are listed before any edge is added: an edge to end must not
+		# be followed into the rest of the automaton, or prefixes of whatever comes
+		# after ~a would be matched as well
+		for state in nfa.number_states(mid_begin):
 			state.add_etrans(end)
 
-		mid_begin.visit(visitor)
+		begin.add_etrans(mid_begin)
+
 
-		begin.add_etrans(mid_begin)
\ No newline at end of file
+def char_class(re, ctx):
+	"""
+	Returns the set of characters if re matches exactly one character out of a set,
+	otherwise returns None.
+	"""
+	if isinstance(re, ReChar):
+		return ctx.intern_chars(re.chars)
+	elif isinstance(re, ReRef):
+		return ctx.get_fragment(re.loc, re.id).get_chars(ctx)
+	elif isinstance(re, ReChoice):
+		chars = set()
+		for part in flatten(re, ReChoice):
+			part_chars = char_class(part, ctx)
+			if part_chars is None:
+				return None
+			chars.update(part_chars)
+		return ctx.intern_chars(chars)
+	return None
+
+
+def flatten(re, node_type):
+	"""
+	Lists the operands of a chain of node_type nodes (ReConcat or ReChoice) from left to right.
+	Long literals and long lists of alternatives produce deeply nested chains,
+	so they are walked with an explicit stack instead of recursion.
+	"""
+	parts = []
+	stack = [re]
+	while stack:
+		node = stack.pop()
+		if isinstance(node, node_type):
+			stack.append(node.right)
+			stack.append(node.left)
+		else:
+			parts.append(node)
+	return parts
+
+
+def walk(re):
+	"""
+	Yields the nodes of re in prefix order, operands from left to right.
+	"""
+	stack = [re]
+	while stack:
+		node = stack.pop()
+		yield node
+		if isinstance(node, (ReConcat, ReChoice)):
+			stack.append(node.right)
+			stack.append(node.left)
+		elif isinstance(node, (ReStar, ReRepeat, RePrefix)):
+			stack.append(node.re)
+
+
+def signature(re):
+	"""
+	Returns a string that is equal for structurally equal regular expressions.
+	Fragments are referred to by name, see references.
+	"""
+	out = []
+	for node in walk(re):
+		if isinstance(node, ReChar):
+			out.append("c" + bytes(sorted(node.chars)).hex())
+		elif isinstance(node, ReEmpty):
+			out.append("e")
+		elif isinstance(node, ReRef):
+			out.append("r" + node.id)
+		elif isinstance(node, ReConcat):
+			out.append(".")
+		elif isinstance(node, ReChoice):
+			out.append("|")
+		elif isinstance(node, ReStar):
+			out.append("*")
+		elif isinstance(node, ReRepeat):
+			out.append("{{{min},{max}}}".format(min=node.min, max=node.max))
+		elif isinstance(node, RePrefix):
+			out.append("~")
+	return " ".join(out)
+
+
+def references(re):
+	# ReRef nodes of re, in order
+	return [node for node in walk(re) if isinstance(node, ReRef)]
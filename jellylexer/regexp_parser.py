@@ -1,3 +1,4 @@
+import re
 from jellylib.parsing import *
 from jellylexer.regexp import *
 
@@ -5,6 +6,14 @@ RegularReChar = Graphicals.difference("~{}[]+*.?<>()\\\"|")
 RefIDChars = LowerLetter | UpperLetter | Digit | frozenset("-_")
 GroupChars = Printables.difference("^-\\[]")
 
+RefIDRegexp = re.compile("[a-zA-Z0-9_\\-]+")
+SpacesRegexp = re.compile("[\n\r\t ]+")
+# printable characters other than '"' and '\\'
+StringCharsRegexp = re.compile("[ !#-\\[\\]-~]+")
+
+# Default upper bound for the counted repetition a{n,m}
+DefaultMaxRepeat = 1000
+
 Escapes = {
 	'n' : ord('\n'),
 	'r' : ord('\r'),
@@ -38,8 +47,9 @@ HexMapping = {
 
 
 class RegexpParser(Parser):
-	def __init__(self):
+	def __init__(self, max_repeat=DefaultMaxRepeat):
 		super().__init__()
+		self.max_repeat = max_repeat
 
 	def run(self):
 		re = self.parse_re(10)
@@ -126,14 +136,12 @@ class RegexpParser(Parser):
 				self.expect('}')
 				if num2 < num1:
 					self.report("second range number must be greater than the first", loc=begin.to(self.loc()))
-				tail = ReEmpty()
-				while num2 > num1:
-					tail = ReChoice(ReConcat(re, tail), ReEmpty())
-					num2 -= 1
-				while num1 > 0:
-					tail = ReConcat(re, tail)
-					num1 -= 1
-				re = tail
+				if num2 > self.max_repeat:
+					self.report(
+						"repetition count {num} exceeds the limit of {limit} (see 'max-repeat' key)".format(num=num2, limit=self.max_repeat),
+						loc=begin.to(self.loc())
+					)
+				re = ReRepeat(re, num1, num2)
 			elif ch == '|' and prec >= 10:
 				self.advance()
 				rhs = self.parse_re(9)
@@ -212,6 +220,10 @@ class RegexpParser(Parser):
 	def parse_string_content(self):
 		re = ReEmpty()
 		while True:
+			chars = self.match(StringCharsRegexp)
+			if chars is not None:
+				for ch in chars:
+					re = ReConcat(re, ReChar([ord(ch)]))
 			ch = self.peek()
 			if ch == '"':
 				break
@@ -249,28 +261,17 @@ class RegexpParser(Parser):
 		return HexMapping[ch]
 
 	def parse_ref_id(self):
-		s = []
-		while True:
-			ch = self.peek()
-			if ch in RefIDChars:
-				self.advance()
-				s.append(ch)
-			else:
-				break
-		if len(s) == 0:
+		id = self.match(RefIDRegexp)
+		if id is None:
 			self.report("expected identifier")
-		return ''.join(s)
+		return id
 
 	def skip_spaces(self):
-		while True:
-			ch = self.peek()
-			if ch in Spaces:
-				self.advance()
-			else:
-				return
+		if self.peek() in Spaces:
+			self.match(SpacesRegexp)
 
-def parse_span(span):
-	parser = RegexpParser()
+def parse_span(span, max_repeat=DefaultMaxRepeat):
+	parser = RegexpParser(max_repeat)
 	parser.set_source(span)
 	re = parser.run()
 	parser.expect(EOF)
@@ -1,7 +1,11 @@
 from jellylib.parsing import *
 from jellylexer.project import parse_project
 from jellylexer.codegen import Codegen
+from jellylexer.grammar import Engines
+from jellylexer.cache import BuildCache, make_entry
+from jellylexer.tables_file import write_tables
 from jellylib.log import log, set_verbosity
+import jellylib.profile as profile
 import argparse
 import sys
 import os
@@ -10,6 +14,14 @@ parser = argparse.ArgumentParser(description="Lexer generator")
 parser.add_argument('--dir', metavar='dir', type=str, help="output directory")
 parser.add_argument('--src', metavar='file', type=str, help="source file (output)")
 parser.add_argument('--header', metavar='file', type=str, help="header file (output)")
+parser.add_argument('--tables', metavar='file', type=str, help="table file (output), the lexer loads its tables from it at runtime")
+parser.add_argument('--table-width', metavar='bits', type=int, choices=(16, 32), help="width of transition table entries (default: the narrowest one that fits)")
+parser.add_argument('--token-width', metavar='bits', type=int, choices=(8, 16), help="run writes token ids of this width directly (default: actions, converted by convert_tokens_ids)")
+parser.add_argument('--parallel', action='store_true', help="generate run_parallel, which lexes on several threads")
+parser.add_argument('--cache-dir', metavar='dir', type=str, help="build cache directory")
+parser.add_argument('--engine', metavar='name', choices=Engines, default=Engines[0], help="how automata are built: thompson (NFA and subset construction) or followpos (directly from the regexps)")
+parser.add_argument('--profile', metavar='file', type=str, help="write time and memory of each generator phase as JSON")
+parser.add_argument('-j', '--jobs', metavar='n', type=int, default=1, help="number of worker processes (0 - one per core)")
 parser.add_argument('input', metavar='input_file', type=str, help="grammar file")
 parser.add_argument("-v", "--verbosity", action="count", default=0, help="increase output verbosity")
 
@@ -17,6 +29,10 @@ args = parser.parse_args()
 
 set_verbosity(args.verbosity)
 
+if args.profile:
+	profile.start()
+	profile.record(input=args.input)
+
 try:
 	dir = args.dir
 	if not dir:
@@ -28,23 +44,59 @@ try:
 	log(2, "Reading {input}...", input=repr(input_file))
 
 	with open(input_file, "r") as f:
-		source = SourceFile(input_file, SourceOpts(4))
-		source.feed(f.read())
+		text = f.read()
 
 	project_name, _ = os.path.splitext(os.path.basename(input_file))
 
-	log(2, "Parsing project...")
-	project = parse_project(source, project_name)
+	cache = None
+	cache_key = None
+	cache_entry = None
+	if args.cache_dir:
+		cache = BuildCache(args.cache_dir)
+		cache_key = cache.key(input_file, text, args.engine, external_tables=args.tables is not None, table_width=args.table_width, token_width=args.token_width, parallel=args.parallel)
+		cache_entry = cache.load(cache_key)
+
 	codegen = Codegen()
-	project.parse()
-	codegen.parse(project)
-	project.check_used()
+	codegen.external_tables = args.tables is not None
+	codegen.table_width = args.table_width
+	codegen.token_width = args.token_width
+	codegen.parallel = args.parallel
+
+	if cache_entry:
+		log(2, "Using cached build")
+		codegen.substs = cache_entry["substs"]
+		codegen.tables = cache_entry["tables"]
+		codegen.table_width = cache_entry["table_width"]
+		for line in cache_entry["warnings"]:
+			print(line, file=sys.stderr)
+		profile.record(cached=True)
+	else:
+		source = SourceFile(input_file, SourceOpts(4))
+		source.feed(text)
 
-	log(2, "Building grammar...")
-	project.build()
+		log(2, "Parsing project...")
+		with profile.phase("phases", "parse_project"):
+			project = parse_project(source, project_name)
+		with profile.phase("phases", "parse"):
+			project.parse()
+			codegen.parse(project)
+			project.check_used()
 
-	log(2, "Running codegen...")
-	codegen.build(project)
+		project.grammar.engine = args.engine
+
+		log(2, "Building grammar...")
+		jobs = args.jobs
+		if jobs <= 0:
+			jobs = os.cpu_count() or 1
+		with profile.phase("phases", "build"):
+			project.build(jobs, cache)
+
+		log(2, "Running codegen...")
+		with profile.phase("phases", "build_tables"):
+			codegen.build(project)
+
+		if cache:
+			cache.store(cache_key, make_entry(codegen, project.grammar))
 
 	src = args.src
 	if not src:
@@ -63,14 +115,27 @@ try:
 
 	log(2, "Writing header file...")
 	os.makedirs(os.path.dirname(header_file), exist_ok=True)
-	with open(header_file, "w") as f:
+	with profile.phase("phases", "write_header"), open(header_file, "w") as f:
 		codegen.write_header(f, os.path.relpath(header_file, dir))
 
 	log(2, "Writing source file...")	
 	os.makedirs(os.path.dirname(source_file), exist_ok=True)
-	with open(source_file, "w") as f:
+	with profile.phase("phases", "write_source"), open(source_file, "w") as f:
 		codegen.write_source(f, os.path.relpath(source_file, dir))
 
+	if args.tables:
+		tables_file = os.path.join(dir, args.tables)
+		log(2, "Writing table file {tables}...", tables=repr(tables_file))
+		os.makedirs(os.path.dirname(tables_file), exist_ok=True)
+		with profile.phase("phases", "write_tables"):
+			write_tables(codegen.tables, tables_file)
+
+	if args.profile:
+		tables = codegen.tables
+		profile.record("tables", states=tables.states_num, classes=tables.classes_num, table_width=codegen.table_width, table_bytes=codegen.table_bytes())
+		log(2, "Writing profile {profile}...", profile=repr(args.profile))
+		profile.write(args.profile)
+
 	log(2, "Completed.")
 
 except Error as e:
@@ -0,0 +1,148 @@
+from jellylib.parsing import SourceFile, SourceOpts
+from jellylib import log
+from jellylexer.project import parse_project
+from jellylexer.codegen import Codegen
+from jellylexer.tables import NoToken, AcceptFlag
+from array import array
+import os
+
+
+class Automaton:
+	"""
+	Lexer tables (see tables.LexerTables) rearranged for the Python loop.
+
+	Rows are indexed by state * classes_num + clss, so the current state is kept
+	premultiplied and one lookup needs a single addition. tokens holds the token
+	index for accepting actions and NoToken for the rest.
+	"""
+
+	def __init__(self, tables):
+		k = tables.classes_num
+		n = tables.states_num
+		self.classes_num = k
+		self.class_map = bytes(tables.eq_classes)
+		self.token_names = list(tables.token_names)
+		self.xstate_begins = {id: base * k for id, base in tables.xstate_bases.items()}
+
+		# Lists instead of arrays: indexing a list does not box the values
+		self.next = [0] * (n * k)
+		self.tokens = [NoToken] * (n * k)
+		for clss in range(k):
+			column = tables.transitions[clss * n:(clss + 1) * n]
+			for state, action in enumerate(column):
+				idx = state * k + clss
+				self.next[idx] = (action & ~AcceptFlag) * k
+				if action & AcceptFlag:
+					self.tokens[idx] = tables.accept_tokens[state]
+
+		self.eof_next = [0] * n
+		self.eof_tokens = [NoToken] * n
+		for state, action in enumerate(tables.eof_transitions):
+			self.eof_next[state] = (action & ~AcceptFlag) * k
+			if action & AcceptFlag:
+				self.eof_tokens[state] = tables.accept_tokens[state]
+
+
+class Lexer:
+	"""
+	Runs an Automaton with the semantics of the generated C++ lexer.
+
+	Token ids are indices in automaton.token_names. After each accepted token its
+	id is appended to tokens and the offset of its end to ends. Both are arrays,
+	which support the buffer protocol, so numpy.frombuffer can wrap them without copying.
+	"""
+
+	def __init__(self, automaton):
+		self.automaton = automaton
+		self.state = 0
+		self.offset = 0
+		self.classes = memoryview(b"")
+		self.tokens = None
+		self.ends = None
+		self.set_buffers()
+
+	def set_buffers(self):
+		# Starts new output buffers, the previous ones are left to the caller
+		self.tokens = array('H')
+		self.ends = array('I')
+
+	def feed(self, data, data_offset=None):
+		"""
+		Provides the next chunk of input. data_offset is the offset of the chunk
+		in the whole stream, by default the chunk follows the previous one.
+		'End of stream' must be signalled with finalize.
+		"""
+		if data_offset is not None:
+			self.offset = data_offset
+		if not isinstance(data, (bytes, bytearray)):
+			data = bytes(data)
+		# One C level pass maps the whole chunk to equivalence classes
+		self.classes = memoryview(data.translate(self.automaton.class_map))
+
+	def set_state(self, xstate_id):
+		if xstate_id not in self.automaton.xstate_begins:
+			raise ValueError("no such state '{state}'".format(state=xstate_id))
+		self.state = self.automaton.xstate_begins[xstate_id]
+
+	def run(self):
+		# Consumes the whole chunk given to feed
+		next_states = self.automaton.next
+		accepts = self.automaton.tokens
+		add_token = self.tokens.append
+		add_end = self.ends.append
+		state = self.state
+		offset = self.offset
+
+		for clss in self.classes:
+			idx = state + clss
+			token = accepts[idx]
+			if token != NoToken:
+				add_token(token)
+				add_end(offset)
+			state = next_states[idx]
+			offset += 1
+
+		self.state = state
+		self.offset = offset
+		self.classes = memoryview(b"")
+
+	def finalize(self):
+		# Parses the 'end of stream' pseudo character, maybe accepts one more token
+		k = self.automaton.classes_num
+		state = self.state // k
+		token = self.automaton.eof_tokens[state]
+		if token != NoToken:
+			self.tokens.append(token)
+			self.ends.append(self.offset)
+		self.state = self.automaton.eof_next[state]
+
+	def token_name(self, token):
+		return self.automaton.token_names[token]
+
+
+def build_automaton(input_file, jobs=1):
+	"""
+	Builds the grammar in a .jlex file and returns its Automaton.
+	Raises jellylib.error.Error for errors in the grammar.
+	"""
+	with open(input_file, "r") as f:
+		text = f.read()
+
+	project_name, _ = os.path.splitext(os.path.basename(input_file))
+	source = SourceFile(input_file, SourceOpts(4))
+	source.feed(text)
+
+	# The generator reports progress on stdout, which is not ours to write to here
+	verbosity = log.Verbosity
+	log.set_verbosity(0)
+	try:
+		project = parse_project(source, project_name)
+		project.parse()
+		codegen = Codegen()
+		codegen.parse(project)
+		project.check_used()
+		project.build(jobs)
+		codegen.build(project)
+	finally:
+		log.set_verbosity(verbosity)
+	return Automaton(codegen.tables)
@@ -0,0 +1,156 @@
+from jellylexer.dfa import NoState
+from array import array
+
+NoToken = -1
+AcceptFlag = 0x80000000
+# 32-bit actions keep the token in bits 19-30 and the next state index in bits 0-18
+TokenShift = 19
+StateMask = 0x7ffff
+MaxStates = StateMask + 1
+# 16-bit actions keep the next state index in 15 bits
+MaxNarrowStates = 0x8000
+
+
+class CodegenState:
+	def __init__(self, xstate, dfa_state, index):
+		self.xstate = xstate
+		self.dfa_state = dfa_state
+		self.index = index
+		self.reset_xstate = None
+
+
+class LexerTables:
+	"""
+	Tables of the generated lexer in numeric form.
+
+	All exclusive states share one numbering of states and byte classes.
+	transitions[clss * states_num + state] and eof_transitions[state] are actions
+	as described in lexer-tables.cpp, with next states stored as state indices,
+	but without the token field. accept_tokens[state] is the index in token_names
+	of the token accepted by the actions of the state, or NoToken.
+	"""
+
+	def __init__(self):
+		self.eq_classes = []
+		self.classes_num = 0
+		self.states_num = 0
+		self.transitions = array('I')
+		self.eof_transitions = array('I')
+		self.accept_tokens = array('i')
+		self.token_names = []
+		self.xstate_bases = dict()
+
+
+def byte_classes(dfas):
+	"""
+	Partitions bytes into classes that none of the automata distinguishes.
+	Returns the class of each byte and the number of classes, classes are
+	numbered in the order of their first byte.
+
+	Bytes are in the same class when they have the same target in every state,
+	i.e. the same column of the transition table. Columns of each automaton get ids,
+	and the signature of a byte is the tuple of its column ids.
+	"""
+	signatures = [[] for char in range(256)]
+	for dfa in dfas:
+		k = dfa.classes_num
+		columns = dict()
+		column_ids = [columns.setdefault(dfa.trans[clss::k].tobytes(), len(columns)) for clss in range(k)]
+		for char, clss in enumerate(dfa.class_map):
+			signatures[char].append(column_ids[clss])
+
+	classes = dict()
+	eq_classes = [classes.setdefault(tuple(signature), len(classes)) for signature in signatures]
+	return eq_classes, len(classes)
+
+
+def make_tables(grammar):
+	tables = LexerTables()
+	tables.eq_classes, tables.classes_num = byte_classes(xstate.dfa for xstate in grammar.xstates.values())
+
+	# first codegen state index of each exclusive state
+	bases = dict()
+	states_list = []
+
+	tokens = dict()
+
+	for xstate in grammar.xstates.values():
+		dfa = xstate.dfa
+		bases[xstate] = len(states_list)
+		tables.xstate_bases[xstate.id] = bases[xstate]
+		for state in range(dfa.states_num):
+			codegen_state = CodegenState(xstate, state, len(states_list))
+			states_list.append(codegen_state)
+			rule = dfa.accept(state)
+			if rule:
+				codegen_state.reset_xstate = rule.target_state
+				token = rule.token
+				if token not in tokens:
+					tokens[token] = len(tokens)
+					tables.token_names.append(token.id)
+			else:
+				codegen_state.reset_xstate = xstate
+
+	states_num = len(states_list)
+	classes_num = tables.classes_num
+	tables.states_num = states_num
+	tables.eof_transitions = array('I', [0]) * states_num
+	tables.accept_tokens = array('i', [NoToken]) * states_num
+
+	# Any byte of a class stands for the whole class
+	class_chars = []
+	for char, clss in enumerate(tables.eq_classes):
+		if clss == len(class_chars):
+			class_chars.append(char)
+
+	# Targets of a state are gathered with one map over its dfa row, dfa classes
+	# are looked up once per exclusive state
+	row_classes = dict()
+	target_values = dict()
+	for xstate in grammar.xstates.values():
+		dfa = xstate.dfa
+		row_classes[xstate] = [dfa.class_map[ch] for ch in class_chars]
+		base = bases[xstate]
+		target_values[xstate] = {target_state: base + target_state for target_state in range(dfa.states_num)}
+
+	# Actions for characters the current state does not accept, by reset state and accept flag.
+	# They continue from the initial state of the reset state, or trap
+	fallbacks = dict()
+
+	def get_fallback(reset_xstate, accept_value):
+		key = (reset_xstate, accept_value)
+		if key not in fallbacks:
+			reset_row = reset_xstate.dfa.row(0)
+			values = target_values[reset_xstate]
+			fallbacks[key] = [
+				accept_value | values[target_state] if target_state != NoState else 0
+				for target_state in map(reset_row.__getitem__, row_classes[reset_xstate])
+			]
+		return fallbacks[key]
+
+	# Rows are collected state by state and transposed at the end
+	rows = []
+	for state in states_list:
+		dfa = state.xstate.dfa
+		rule = dfa.accept(state.dfa_state)
+
+		if rule:
+			# accept...
+			accept_value = 0x80000000
+			tables.accept_tokens[state.index] = tokens[rule.token]
+		else:
+			# does not accept
+			accept_value = 0
+
+		# NoState is not a key of target_values, so such targets take the fallback action
+		row = dfa.row(state.dfa_state)
+		targets = map(row.__getitem__, row_classes[state.xstate])
+		rows.extend(map(target_values[state.xstate].get, targets, get_fallback(state.reset_xstate, accept_value)))
+
+		tables.eof_transitions[state.index] = accept_value
+
+	tables.transitions = array('I')
+	for clss in range(classes_num):
+		tables.transitions.extend(rows[clss::classes_num])
+
+	return tables
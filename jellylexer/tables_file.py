@@ -0,0 +1,110 @@
+from jellylexer.tables import LexerTables, NoToken, TokenShift
+from array import array
+import itertools
+import operator
+
+# Layout is described in lexer-tables-file.cpp, bump the version when it changes
+TablesMagic = b"JLEXTBLS"
+TablesVersion = 3
+ByteOrderMark = 0x01020304
+HeaderWords = 10
+
+
+def pack_tables(tables):
+	"""
+	Returns the table file of the lexer tables as bytes, in the native byte order.
+	"""
+	states_num = tables.states_num
+	xstates = list(tables.xstate_bases.items())
+
+	names = bytearray()
+	for name in tables.token_names + [id for id, _ in xstates]:
+		names += name.encode() + b"\0"
+
+	header = array('I', [
+		0, 0,
+		TablesVersion,
+		ByteOrderMark,
+		tables.classes_num,
+		states_num,
+		len(tables.token_names),
+		len(xstates),
+		len(names),
+		0
+	])
+
+	words = array('I')
+	words.extend(clss * states_num for clss in tables.eq_classes)
+	words.extend(tables.transitions)
+	words.extend(tables.eof_transitions)
+
+	# token field of actions in accepting states
+	token_fields = [token << TokenShift if token != NoToken else 0 for token in tables.accept_tokens]
+	for clss in range(tables.classes_num + 1):
+		begin = 256 + clss * states_num
+		words[begin:begin + states_num] = array('I', map(operator.or_, words[begin:begin + states_num], token_fields))
+
+	words.extend(base for _, base in xstates)
+
+	return TablesMagic + header.tobytes()[8:] + words.tobytes() + bytes(names)
+
+
+def unpack_tables(data):
+	"""
+	Restores LexerTables from the contents of a table file.
+	Raises ValueError if data is not a table file of this version.
+	"""
+	data = bytes(data)
+	if len(data) < HeaderWords * 4 or data[:8] != TablesMagic:
+		raise ValueError("not a lexer table file")
+
+	header = array('I')
+	header.frombytes(data[:HeaderWords * 4])
+	_, _, version, byte_order, classes_num, states_num, tokens_num, xstates_num, names_size, _ = header
+	if version != TablesVersion:
+		raise ValueError("unsupported table file version {version}".format(version=version))
+	if byte_order != ByteOrderMark:
+		raise ValueError("table file has a different byte order")
+
+	table_size = classes_num * states_num
+	words_num = 256 + table_size + states_num + xstates_num
+	if len(data) != (HeaderWords + words_num) * 4 + names_size:
+		raise ValueError("table file has a wrong size")
+
+	words = array('I')
+	words.frombytes(data[HeaderWords * 4:(HeaderWords + words_num) * 4])
+	names = data[(HeaderWords + words_num) * 4:].split(b"\0")[:-1]
+	if len(names) != tokens_num + xstates_num:
+		raise ValueError("table file has wrong names")
+
+	tables = LexerTables()
+	tables.classes_num = classes_num
+	tables.states_num = states_num
+	tables.eq_classes = [begin // states_num for begin in words[:256]]
+	tables.token_names = [name.decode() for name in names[:tokens_num]]
+
+	actions = words[256:256 + table_size + states_num]
+	tables.accept_tokens = array('i', [NoToken]) * states_num
+	for state in range(states_num):
+		action = actions[table_size + state]
+		if action & 0x80000000:
+			tables.accept_tokens[state] = (action >> TokenShift) & 0xfff
+	actions = array('I', map(operator.and_, actions, itertools.repeat(0xffffffff & ~(0xfff << TokenShift))))
+	tables.transitions = actions[:table_size]
+	tables.eof_transitions = actions[table_size:]
+
+	bases = words[256 + table_size + states_num:]
+	for name, base in zip(names[tokens_num:], bases):
+		tables.xstate_bases[name.decode()] = base
+
+	return tables
+
+
+def write_tables(tables, path):
+	with open(path, "wb") as f:
+		f.write(pack_tables(tables))
+
+
+def read_tables(path):
+	with open(path, "rb") as f:
+		return unpack_tables(f.read())
@@ -1,6 +1,6 @@
 class Error(RuntimeError):
 	def __init__(self, loc, message):
-		super().__init__()
+		super().__init__(loc, message)
 		self.loc = loc
 		self.message = message
 
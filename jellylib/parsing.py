@@ -1,3 +1,5 @@
+import re
+from bisect import bisect_right
 from jellylib.error import Error
 
 EOF = object()
@@ -13,75 +15,55 @@ Printables = frozenset(map(chr, range(32, 127)))
 Graphicals = frozenset(map(chr, range(33, 127)))
 Punctuation = Graphicals.difference(LowerLetter | UpperLetter | Digit)
 
+LineBreakRegexp = re.compile("\r\n?|\n")
+
 class SourceOpts:
 	def __init__(self, tab_size):
 		self.tab_size = tab_size
 
 
 class SourceFile:
+	"""
+	Text of a source file. Positions are indices into the text,
+	line and column numbers are only computed when a location is printed.
+	"""
+
 	def __init__(self, filename, opts):
 		self.filename = filename
-		self.data = []
+		self.text = ""
 		self.lines = None
 		self.opts = opts
 
 	def feed(self, chr_seq):
-		self.data.extend(chr_seq)
-
-	def compare_pos(self, pos1, pos2):
-		return pos1 == pos2
+		self.text += ''.join(chr_seq)
+		self.lines = None
 
 	def loc(self, pos):
 		return SourceLoc(self, pos, pos)
 
-	def advance_pos(self, pos):
-		return pos + 1
-
-	def at_pos(self, idx):
-		return self.data[idx]
-
 	def get_span(self):
-		return (self, 0, len(self.data))
+		return (self, 0, len(self.text))
 
 	def get_line_col_info(self, pos):
 		if not self.lines:
 			self._fill_line_info()
-		line = self._bin_search_line(pos)
-		p = self.lines[line]
+		line = bisect_right(self.lines, pos) - 1
 		col = 0
-		while p < pos:
-			ch = self.data[p]
+		for ch in self.text[self.lines[line]:pos]:
 			if ch == '\t':
 				col = (col + self.opts.tab_size) // self.opts.tab_size * self.opts.tab_size
 			elif ch in '\n\r':
 				pass
 			else:
 				col += 1
-			p += 1
 		return line + 1, col + 1
 
-	def _bin_search_line(self, pos):
-		begin = 0
-		end = len(self.lines)
-		while end - begin > 1:
-			mid = (end + begin) // 2
-			if self.lines[mid] > pos:
-				end = mid
-			else:
-				begin = mid
-		return begin
-
 	def _fill_line_info(self):
+		# a line break at the very end does not start a new line
 		self.lines = [0]
-		state = 0
-		for i, ch in enumerate(self.data):
-			if (state == 1) or (state == 2 and ch != '\n'):
-				self.lines.append(i)
-				state = 0
-			if ch == '\n':
-				state = 1
-			elif ch == '\r':
-				state = 2
+		for m in LineBreakRegexp.finditer(self.text):
+			if m.end() < len(self.text):
+				self.lines.append(m.end())
 
 
 class SourceLoc:
@@ -120,80 +102,71 @@ class SourceLoc:
 class ArtificialSource:
 	def __init__(self, loc):
 		self.myloc = loc
-		self.data = []
+		self.text = ""
 
 	def feed(self, chr_seq):
-		self.data.extend(chr_seq)
-
-	def compare_pos(self, pos1, pos2):
-		return pos1 == pos2
+		self.text += ''.join(chr_seq)
 
 	def loc(self, pos):
 		return self.myloc
 
-	def advance_pos(self, pos):
-		return pos + 1
-
-	def at_pos(self, idx):
-		return self.data[idx]
-
 	def get_span(self):
-		return (self, 0, len(self.data))
+		return (self, 0, len(self.text))
 
 
 class SourceSpans:
+	"""
+	Sequence of spans from other sources, parsed as one text.
+	Positions are indices into the joined text and are mapped back
+	to the original source for locations.
+	"""
+
 	def __init__(self):
 		self.spans = []
+		self.joined = None
+		self.starts = None
 
 	def add_span(self, provider, begin, end):
 		self.spans.append((provider, begin, end))
+		self.joined = None
 
 	def add_seq(self, loc, seq):
 		src = ArtificialSource(loc)
 		src.feed(seq)
-		self.spans.append(src.get_span())
+		self.add_span(*src.get_span())
+
+	@property
+	def text(self):
+		self._join()
+		return self.joined
+
+	def _join(self):
+		if self.joined is None:
+			parts = []
+			self.starts = []
+			size = 0
+			for provider, begin, end in self.spans:
+				self.starts.append(size)
+				parts.append(provider.text[begin:end])
+				size += end - begin
+			self.joined = ''.join(parts)
 
 	def loc(self, pos):
-		return self.spans[pos[0]][0].loc(pos[1])
-
-	def compare_pos(self, pos1, pos2):
-		pos1 = self.skip_empty(pos1)
-		pos2 = self.skip_empty(pos2)
-		return pos1 == pos2
-
-	def at_pos(self, pos):
-		pos = self.skip_empty(pos)
-		return self.spans[pos[0]][0].at_pos(pos[1])
-
-	def advance_pos(self, pos):
-		span = self.spans[pos[0]]
-		if span[0].compare_pos(pos[1], span[2]):
-			pos = (pos[0] + 1, self.spans[pos[0] + 1][1])
-		else:
-			pos = (pos[0], span[0].advance_pos(pos[1]))
-		return self.skip_empty(pos)
-
-	def skip_empty(self, pos):
-		while True:
-			span = self.spans[pos[0]]
-			if span[0].compare_pos(pos[1], span[2]) and pos[0] < len(self.spans) - 1:
-				pos = (pos[0] + 1, self.spans[pos[0] + 1][1])
-			else:
-				return pos
-
-	def begin_pos(self):
-		return (0, self.spans[0][1])
-
-	def end_pos(self):
-		return (len(self.spans) - 1, self.spans[-1][2])
+		# A position at the end of a span belongs to the next non-empty span,
+		# the end of the text to the last span
+		self._join()
+		idx = bisect_right(self.starts, pos) - 1
+		provider, begin, end = self.spans[idx]
+		return provider.loc(begin + pos - self.starts[idx])
 
 	def get_span(self):
-		return self, self.begin_pos(), self.end_pos()
+		return self, 0, len(self.text)
 
 
 class InputStream:
 	def __init__(self, provider, begin:int, end:int):
 		self.provider = provider
+		self.text = provider.text
 		self.begin = begin
 		self.end = end
 		self.cur = begin
@@ -214,17 +187,23 @@ class InputStream:
 		return self.provider.loc(self.cur)
 
 	def peek(self):
-		if self.provider.compare_pos(self.cur, self.end):
-			return EOF
-		return self.provider.at_pos(self.cur)
+		if self.cur < self.end:
+			return self.text[self.cur]
+		return EOF
 
 	def advance(self):
-		if self.is_eof():
-			return
-		self.cur = self.provider.advance_pos(self.cur)
+		if self.cur < self.end:
+			self.cur += 1
+
+	def match(self, pattern):
+		m = pattern.match(self.text, self.cur, self.end)
+		if not m:
+			return None
+		self.cur = m.end()
+		return m.group()
 
 	def is_eof(self):
-		return self.peek() is EOF
+		return self.cur >= self.end
 
 
 class ParseError(Error):
@@ -260,6 +239,13 @@ class Parser:
 		self.stream.advance()
 		return ch
 
+	def match(self, pattern):
+		"""
+		Consumes the match of a compiled regular expression at the current position.
+		Returns the matched text or None.
+		"""
+		return self.stream.match(pattern)
+
 	def tell(self):
 		return self.stream.tell()
 
@@ -284,9 +270,5 @@ class Parser:
 
 
 def parse_string(source):
-	p = Parser()
-	p.set_source(source)
-	s = []
-	while not p.is_eof():
-		s.append(p.take())
-	return ''.join(s)
\ No newline at end of file
+	provider, begin, end = source.get_span()
+	return provider.text[begin:end]
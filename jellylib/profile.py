@@ -0,0 +1,99 @@
+import json
+import time
+import tracemalloc
+
+# Report of the current run, None when profiling is off
+Report = None
+
+# Open phases, [entry, begin time, peak memory so far]
+Open = []
+
+
+def start():
+	"""
+	Turns profiling on. Phases record wall time and peak traced memory, which
+	slows the generator down, so this is only done when a profile is requested.
+	"""
+	global Report
+	Report = dict()
+	del Open[:]
+	if not tracemalloc.is_tracing():
+		tracemalloc.start()
+
+
+def enabled():
+	return Report is not None
+
+
+def entry(path):
+	node = Report
+	for key in path:
+		node = node.setdefault(key, dict())
+	return node
+
+
+def record(*path, **values):
+	# Sets values in the report, path names nested objects
+	if Report is not None:
+		entry(path).update(values)
+
+
+def update_peaks():
+	_, peak = tracemalloc.get_traced_memory()
+	for item in Open:
+		item[2] = max(item[2], peak)
+	tracemalloc.reset_peak()
+
+
+class phase:
+	"""
+	Context manager that records the wall time and the peak traced memory of
+	the code inside it as {"time": seconds, "peak_memory": bytes} under path.
+	Time of a phase that is entered several times adds up.
+	"""
+	def __init__(self, *path):
+		self.path = path
+
+	def __enter__(self):
+		if Report is not None:
+			update_peaks()
+			Open.append([entry(self.path), time.perf_counter(), 0])
+		return self
+
+	def __exit__(self, *exc):
+		if Report is not None:
+			update_peaks()
+			node, begin, peak = Open.pop()
+			node["time"] = node.get("time", 0.0) + time.perf_counter() - begin
+			node["peak_memory"] = max(node.get("peak_memory", 0), peak)
+		return False
+
+
+def take():
+	"""
+	Returns the report so far and starts an empty one. Worker processes send
+	their reports to the main process, which adds them with merge.
+	"""
+	global Report
+	report = Report
+	if report is not None:
+		Report = dict()
+	return report
+
+
+def merge(report, node=None):
+	if Report is None or report is None:
+		return
+	if node is None:
+		node = Report
+	for key, value in report.items():
+		if isinstance(value, dict):
+			merge(value, node.setdefault(key, dict()))
+		else:
+			node[key] = value
+
+
+def write(filename):
+	with open(filename, "w") as f:
+		json.dump(Report, f, indent=1)
+		f.write("\n")